@@ -0,0 +1,233 @@
+"""
+End-to-end throughput benchmark for the paper pipeline.
+
+Runs the real stages (parse, caption, split, generate, render) over a fixed corpus with
+the deterministic stub backends, so the numbers only measure the pipeline itself and are
+reproducible on any machine. Reports per-stage wall time, pages/s, sections/s and peak RSS
+(of this process and of the largest parse worker), and compares against benchmarks/baseline.json.
+
+    python benchmarks/bench_pipeline.py                       # 5 papers from fineTune/papers
+    python benchmarks/bench_pipeline.py --limit 0 --repeat 3  # whole corpus, median of 3
+    python benchmarks/bench_pipeline.py --save-baseline       # store the current numbers
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CORPUS = os.path.join(REPO_ROOT, "fineTune", "papers")
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "benchmarks", "baseline.json")
+
+sys.path.insert(0, REPO_ROOT)
+from utils.tracing import peak_rss_mb
+
+STAGES = ["parse", "caption", "split", "generate", "render"]
+
+# A stage (or peak RSS) this much slower / bigger than the baseline counts as a regression
+DEFAULT_TOLERANCE = 0.20
+
+
+def count_pages(pdf_path: str) -> int:
+    import pymupdf
+    with pymupdf.open(pdf_path) as doc:
+        return doc.page_count
+
+
+def run_once(pdf_paths, tokens_per_second: float, seconds_per_image: float, fused: bool = False,
+             prefill_tokens_per_second: float = 0.0, batch_size: int = 1, verbose: bool = False) -> dict:
+    """
+    One pass over the corpus into a fresh vault, with no caches, so every stage does its full work.
+    """
+    vault = tempfile.mkdtemp(prefix="paper-bench-")
+    os.environ["OBSIDIAN_VAULT_PATH"] = vault
+
+    import obsidian_paper as op
+    from utils.backends import StubTextBackend, StubVisionBackend
+    from utils.concept_index import index_path
+    from utils.related import index_dir
+    from utils.vision import inject_captions, run_captions
+
+    op.OBSIDIAN_VAULT_PATH = vault
+    text = StubTextBackend(tokens_per_second=tokens_per_second, prefill_tokens_per_second=prefill_tokens_per_second)
+    vision = StubVisionBackend(seconds_per_image=seconds_per_image)
+
+    timings = {stage: 0.0 for stage in STAGES}
+    sections = images = 0
+
+    def timed(stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        timings[stage] += time.perf_counter() - start
+        return result
+
+    def caption(paper):
+        plan = paper.pop("caption_plan")
+        if plan is not None:
+            paper["md_text"] = inject_captions(paper["md_text"], run_captions(plan, vision))
+            return plan["links"]
+        return 0
+
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            for pdf_path in pdf_paths:
+                paper = timed("parse", op.parse_stage, pdf_path, vision, None)
+                images += timed("caption", caption, paper)
+                timed("split", op.split_stage, paper, text)
+                timed("generate", op.generate_styles, [paper], text, None, fused, batch_size)
+                timed("render", op.write_stage, paper)
+                sections += sum(1 for header, _ in paper["sections"] if not op.is_skipped_section(header))
+    finally:
+        shutil.rmtree(vault, ignore_errors=True)
+        if os.path.exists(index_path(vault)):
+            os.remove(index_path(vault))
+        shutil.rmtree(index_dir(vault), ignore_errors=True)
+
+    return {"timings": timings, "sections": sections, "images": images}
+
+
+def summarize(runs, pages: int, papers: int) -> dict:
+    from utils.pdf_markdown import shutdown_pool
+
+    # Parse workers only show up in RUSAGE_CHILDREN once they have exited
+    shutdown_pool()
+    # Median per stage, so one noisy repeat doesn't decide the result
+    timings = {stage: statistics.median(run["timings"][stage] for run in runs) for stage in STAGES}
+    total = sum(timings.values())
+    sections = runs[0]["sections"]
+    return {
+        "papers": papers,
+        "pages": pages,
+        "sections": sections,
+        "images": runs[0]["images"],
+        "stages": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+        "total_seconds": round(total, 4),
+        "pages_per_second": round(pages / total, 3) if total else None,
+        "sections_per_second": round(sections / total, 3) if total else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "peak_worker_rss_mb": round(peak_rss_mb(children=True), 1),
+    }
+
+
+def print_report(result: dict):
+    print(f"\n{result['papers']} papers, {result['pages']} pages, {result['sections']} sections, {result['images']} images")
+    for stage in STAGES:
+        seconds = result["stages"][stage]
+        share = 100 * seconds / result["total_seconds"] if result["total_seconds"] else 0
+        print(f"  {stage:<10} {seconds:9.3f}s  {share:5.1f}%")
+    print(f"  {'total':<10} {result['total_seconds']:9.3f}s")
+    print(f"  pages/s    {result['pages_per_second']}")
+    print(f"  sections/s {result['sections_per_second']}")
+    print(f"  peak RSS   {result['peak_rss_mb']} MB (largest parse worker {result['peak_worker_rss_mb']} MB)")
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a list of regression messages (empty = OK).
+    """
+    if baseline.get("corpus") != result.get("corpus"):
+        print("⚠️ Baseline was recorded on a different corpus or stub settings, comparison is approximate")
+    if baseline.get("machine") != result.get("machine"):
+        print(f"⚠️ Baseline was recorded on {baseline.get('machine')}, times from another machine only compare roughly")
+
+    regressions = []
+    print(f"\nvs baseline (tolerance {tolerance:.0%}):")
+    checks = [(stage, result["stages"][stage], baseline["stages"].get(stage)) for stage in STAGES]
+    for name in ("peak_rss_mb", "peak_worker_rss_mb"):
+        checks.append((name, result[name], baseline.get(name)))
+    for name, now, before in checks:
+        if not before:
+            print(f"  {name:<18} {now:9.3f}  (no baseline)")
+            continue
+        change = now / before - 1
+        # Sub-10ms stages are all noise
+        regressed = change > tolerance and (name.startswith("peak_") or now - before > 0.01)
+        print(f"  {name:<18} {now:9.3f}  was {before:9.3f}  {change:+6.1%}{'  ❌' if regressed else ''}")
+        if regressed:
+            regressions.append(f"{name} {change:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the paper pipeline with stub models")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Directory of PDFs (default fineTune/papers)")
+    parser.add_argument("--limit", type=int, default=5, help="Use the first N PDFs (0 = all)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per benchmark; the median is reported")
+    parser.add_argument("--tps", type=float, default=0.0, help="Stub generation speed in tokens/s (0 = instant)")
+    parser.add_argument("--prefill-tps", type=float, default=0.0, help="Stub prompt processing speed in tokens/s (0 = instant)")
+    parser.add_argument("--image-seconds", type=float, default=0.0, help="Stub seconds per caption")
+    parser.add_argument("--batch-size", type=int, default=1, help="Sections decoded together per adapter")
+    parser.add_argument("--fused", action="store_true", help="Benchmark fused multi-perspective generation")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--json", help="Also write the result to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own progress output")
+    args = parser.parse_args()
+
+    # Stage code resolves adapters/ relative to the working directory
+    args.corpus = os.path.abspath(args.corpus)
+    os.chdir(REPO_ROOT)
+
+    pdf_paths = sorted(os.path.join(args.corpus, f) for f in os.listdir(args.corpus) if f.lower().endswith(".pdf"))
+    if args.limit:
+        pdf_paths = pdf_paths[:args.limit]
+    if not pdf_paths:
+        parser.error(f"no PDFs in {args.corpus}")
+
+    pages = sum(count_pages(p) for p in pdf_paths)
+    print(f"Benchmarking {len(pdf_paths)} papers ({pages} pages), {args.repeat} run(s)")
+
+    runs = []
+    for i in range(args.repeat):
+        runs.append(run_once(
+            pdf_paths, args.tps, args.image_seconds, args.fused, args.prefill_tps, args.batch_size, args.verbose
+        ))
+        print(f"  run {i + 1}: {sum(runs[-1]['timings'].values()):.2f}s")
+
+    result = summarize(runs, pages, len(pdf_paths))
+    result["corpus"] = {
+        "pdfs": [os.path.basename(p) for p in pdf_paths],
+        "tps": args.tps,
+        "prefill_tps": args.prefill_tps,
+        "image_seconds": args.image_seconds,
+        "fused": args.fused,
+        "batch_size": args.batch_size,
+    }
+    result["machine"] = {"system": platform.system(), "machine": platform.machine(), "cpus": os.cpu_count()}
+    print_report(result)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline} yet, run with --save-baseline to create one")
+        return
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    regressions = compare(result, baseline, args.tolerance)
+    if regressions:
+        print(f"\n❌ Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,36 @@
 import re
-from mlx_lm import load, generate
-import pymupdf4llm
+import argparse
+import glob
+import json
 from typing import List, Dict, Tuple
 import os
 import pathlib
 import sys
 import shutil
 from dotenv import load_dotenv
-from utils.vision import caption_images_in_markdown
+from utils.vision import VISION_MODEL, caption_images_in_markdown, inject_captions, plan_captions, run_captions
+from utils.pipeline import BackgroundWorker, prefetch
+from utils.backends import BACKENDS, make_backends
+from utils.cache import DiskCache, hash_file, hash_text
+from utils.journal import JOURNAL_SUFFIX, PaperJournal, unfinished_journals
+from utils.note_writer import NoteWriter
+from utils.chunking import reduce_groups, reduce_partials, split_into_chunks
+from utils.revisions import SECTIONS_SUFFIX, SectionState
+from utils.tracing import TRACER
+from utils.fused import format_perspective, load_panel_spec, parse_panel_response
+from utils.daemon import STATUS_FILE as DAEMON_STATUS_FILE, run_daemon
+from utils.pdf_markdown import to_markdown
+from utils.concept_index import CONCEPT_INDEX, LINK_PATTERN, load_index, wikilink
+from utils.residency import GB, RESIDENCY
+from utils.prompt_compression import COMPRESSION, check_steps, compress_section, estimate_tokens, reference_numbers
 
 load_dotenv()
 
+# Checked when a command actually needs it (require_vault), so importing this module never fails
 OBSIDIAN_VAULT_PATH = os.environ.get("OBSIDIAN_VAULT_PATH")
-if not OBSIDIAN_VAULT_PATH:
-    raise EnvironmentError("OBSIDIAN_VAULT_PATH is not set in .env file")
 BASE_MODEL = "mlx-community/Llama-3.2-3B-Instruct-4bit"
+# Same tokenizer as BASE_MODEL, used as the draft for --speculative
+DRAFT_MODEL = "mlx-community/Llama-3.2-1B-Instruct-4bit"
 
 ADAPTERS = {
     "eli5": "adapters/eli5_final/",
@@ -68,6 +84,10 @@ def extract_paper_title(paper_text: str, paper_name:str) -> str:
     # We use specific keywords to stop early if Abstract isn't found immediately
     title_pattern = r"^#?\s*(.+?)(?:\n\n\n|\n\n.*?abstract|author|By\s)"
     
+    # Without "abstract" the regex below can't match, but it takes quadratic time to find out
+    if "abstract" not in paper_text.lower():
+        return "Unknown Title"
+
     # Fallback: The original regex is good, just adding non-greedy (+?) to be safer
     match = re.search(r"#?\s+(.+?)abstract", paper_text, re.IGNORECASE | re.DOTALL)
     
@@ -94,25 +114,26 @@ def extract_paper_title(paper_text: str, paper_name:str) -> str:
 
     return "Unknown Title"
 
-def parse_pdf_sections_robust(pdf_path: str, image_subfolder: str, image_path: str) -> List[Tuple[str, str]]:
-    # 1. Convert PDF to Markdown
-    md_text = pymupdf4llm.to_markdown(
-        pdf_path,
-        image_path=image_path,
-        write_images=True,
-        image_format="png"
-    )
+def pdf_to_markdown(pdf_path: str, image_subfolder: str, image_path: str) -> str:
+    # 1. Convert PDF to Markdown (page shards across a process pool for long documents)
+    md_text = to_markdown(pdf_path, image_path)
 
     # 2. Fix Image Paths
     abs_path_prefix = str(pathlib.Path(image_path).absolute())
-    md_text = md_text.replace(abs_path_prefix, image_subfolder)
+    return md_text.replace(abs_path_prefix, image_subfolder)
+
+def parse_pdf_sections_robust(pdf_path: str, image_subfolder: str, image_path: str) -> List[Tuple[str, str]]:
+    md_text = pdf_to_markdown(pdf_path, image_subfolder, image_path)
 
     # 2.1 caption images
-    md_text = caption_images_in_markdown(md_text, OBSIDIAN_VAULT_PATH)
+    md_text = caption_images_in_markdown(md_text, OBSIDIAN_VAULT_PATH, cache=DiskCache("captions"))
 
     global paper_full_text
     paper_full_text = md_text
 
+    return split_markdown_sections(md_text)
+
+def split_markdown_sections(md_text: str) -> List[Tuple[str, str]]:
     # 3. Regex for standard Markdown headers (#)
     header_pattern = re.compile(r'^(#+)\s+(.*)$')
 
@@ -180,19 +201,9 @@ def parse_pdf_sections_robust(pdf_path: str, image_subfolder: str, image_path: s
     return sections
 
 def parse_pdf_sections(pdf_path: str, image_subfolder: str, image_path: str) -> List[Tuple[str, str]]:
-    
-    # 1. Convert PDF to Markdown
-    md_text = pymupdf4llm.to_markdown(
-        pdf_path,
-        image_path=image_path,
-        write_images=True,
-        image_format="png"
-    )
+    # 1. + 2. Convert PDF to Markdown with image paths fixed for Obsidian
+    md_text = pdf_to_markdown(pdf_path, image_subfolder, image_path)
 
-    # 2. Fix Image Paths for Obsidian
-    abs_path_prefix = str(pathlib.Path(image_path).absolute())
-    md_text = md_text.replace(abs_path_prefix, image_subfolder)
-    
     # 3. Regex to catch ANY header line (1 to 6 hashes)
     header_pattern = re.compile(r'^(#+)\s+(.*)$', re.MULTILINE)
     
@@ -250,28 +261,86 @@ def parse_pdf_sections(pdf_path: str, image_subfolder: str, image_path: str) ->
 
     return sections
 
-def extract_concepts(full_text):
-    """
-    Special step: Ask the model to generate a list of Tags/Topics for the Graph.
-    """
-    # Use Executive brain for this as it's good at extraction
-    model, tokenizer = load(BASE_MODEL, adapter_path=ADAPTERS['executive'])
-    
-    prompt = f"""
+CONCEPT_PROMPT = """
     Analyze this text. List the Top 5 key technical concepts, architectures, or algorithms mentioned.
     Format them as a comma-separated list wrapped in brackets.
     Example: [[Transformer]], [[Attention Mechanism]], [[Google]], [[NLP]], [[Optimization]]
     
     Text:
-    {full_text[:6000]}
+    {text}
     """
+
+CONCEPT_PARAMS = {"max_tokens": 100}
+CONCEPT_COUNT = 5
+
+def vault_index():
+    """
+    Titles / aliases / headings of the notes already in the vault (None if PAPER_CONCEPT_INDEX=0).
+    """
+    return load_index(OBSIDIAN_VAULT_PATH) if CONCEPT_INDEX else None
+
+def template_prefix(template: str, field: str) -> str:
+    """
+    The fixed text of a str.format template before {field}: the part every call shares,
+    which the backend can prefill once and reuse (prompt-prefix KV cache).
+    """
+    return template.split("{" + field + "}")[0].replace("{{", "{").replace("}}", "}")
+
+def generation_cache_key(style: str, prompt_template: str, text: str, params: Dict, backend) -> str:
+    """
+    Everything that can change the model's answer goes into the key: backend, base model,
+    the exact adapter weights, the prompt template, the input text and the sampling params.
+    """
+    return DiskCache.make_key(
+        backend=backend.cache_id,
+        base_model=BASE_MODEL,
+        adapter=hash_file(os.path.join(ADAPTERS[style], "adapters.safetensors")),
+        prompt=prompt_template,
+        text=hash_text(text),
+        params=params,
+    )
+
+def concepts_cache_key(full_text: str, backend) -> str:
+    return generation_cache_key("executive", CONCEPT_PROMPT, full_text[:6000], CONCEPT_PARAMS, backend)
+
+def extract_concepts(full_text, backend, cache: DiskCache = None, index=None, exclude=()):
+    """
+    Special step: Ask the model to generate a list of Tags/Topics for the Graph.
+
+    With a vault index, concepts that already have a note come first, and when the text
+    mentions CONCEPT_COUNT of them (by title or alias) the model isn't asked at all. The model's own links are
+    pointed at the note they name.
+    """
+    text = full_text[:6000]
+    known = [wikilink(target) for target in index.top_concepts(text, CONCEPT_COUNT, exclude)] if index else []
+    if len(known) >= CONCEPT_COUNT:
+        return ", ".join(known)
+
+    response = _model_concepts(text, full_text, backend, cache)
+    if index is None:
+        return response
+    linked = [wikilink(index.lookup(name) or name, name) for name in LINK_PATTERN.findall(response)]
+    merged = list(dict.fromkeys(known + linked))[:CONCEPT_COUNT]
+    return ", ".join(merged) if merged else response
+
+def _model_concepts(text: str, full_text: str, backend, cache: DiskCache = None) -> str:
+    key = concepts_cache_key(full_text, backend)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    # Use Executive brain for this as it's good at extraction
+    backend.use_adapter("executive")
     
-    messages = [{"role": "user", "content": prompt}]
-    prompt_fmt = tokenizer.apply_chat_template(messages, add_generation_prompt=True)
-    response = generate(model, tokenizer, prompt=prompt_fmt, max_tokens=100, verbose=False)
+    prompt = CONCEPT_PROMPT.format(text=text)
+    response = backend.generate(prompt, prefix=template_prefix(CONCEPT_PROMPT, "text"), **CONCEPT_PARAMS)
     
     # Simple cleanup to ensure they look like links
-    return response.strip()
+    response = response.strip()
+    if cache is not None:
+        cache.put(key, response, meta={"style": "executive", "kind": "concepts"})
+    return response
 
 def extract_visuals_only(content: str):
     lines = content.split('\n')
@@ -295,110 +364,1074 @@ def extract_visuals_only(content: str):
             i += 1
     return visuals
 
-def main():
-    global paper_full_text
-    if(len(sys.argv) != 2):
-        print("Usage: python obsidian_paper.py <paper_name>")
-        return
-    pdf_path = sys.argv[1]
-    paper_name = os.path.basename(pdf_path).replace(".pdf", "")
-    safe_name = "".join(c for c in paper_name if c.isalnum() or c.isspace()).rstrip()
+SKIP_SECTIONS = ["reference", "citation", "acknowledg", "bibliography"]
+
+# Adapter-major order for batch runs. The note layout still follows STYLE_CONFIG.
+GENERATION_ORDER = ["eli5", "intuitive", "executive"]
+
+def is_skipped_section(header: str) -> bool:
+    return any(x in header.lower() for x in SKIP_SECTIONS)
 
-    output_file = os.path.join(OBSIDIAN_VAULT_PATH, f"{safe_name}.md")
+def collect_pdfs(paths: List[str]) -> List[str]:
+    """
+    Expands directories into the PDFs they contain (sorted, non-recursive).
+    """
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            pdfs.extend(sorted(
+                os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(".pdf")
+            ))
+        elif path.lower().endswith(".pdf") and os.path.exists(path):
+            pdfs.append(path)
+        else:
+            print(f"Skipping {path}: not a PDF or directory")
+    return pdfs
+
+ARXIV_VERSION_PATTERN = re.compile(r'^(\d{4}\.\d{4,5})v\d+$')
 
+# Stage outputs of the parse / caption subcommands, kept next to the paper's assets
+PARSED_SUFFIX = ".parsed.md"
+CAPTIONED_SUFFIX = ".captioned.md"
+
+def paper_paths(pdf_path: str) -> Dict:
+    """
+    Where everything of one paper lives in the vault. No side effects.
+    """
+    paper_name = os.path.basename(pdf_path).replace(".pdf", "")
+    # 2401.12345v2 -> 2401.12345 so a new arXiv version updates the same note
+    paper_name = ARXIV_VERSION_PATTERN.sub(r"\1", paper_name)
+    safe_name = clear_paper_file_name(paper_name)
     image_subfolder = f"assets/{safe_name}"
-    full_image_path = os.path.join(OBSIDIAN_VAULT_PATH, image_subfolder)
+    asset_dir = os.path.join(OBSIDIAN_VAULT_PATH, image_subfolder)
 
-    os.makedirs(full_image_path, exist_ok=True)
-    
-    pdf_dest_path = os.path.join(full_image_path, f"{safe_name}.pdf")
-    shutil.copy(pdf_path, pdf_dest_path)
-    
+    return {
+        "pdf_path": pdf_path,
+        "paper_name": paper_name,
+        "safe_name": safe_name,
+        "image_subfolder": image_subfolder,
+        "asset_dir": asset_dir,
+        "pdf_copy": os.path.join(asset_dir, f"{safe_name}.pdf"),
+        "output_file": os.path.join(OBSIDIAN_VAULT_PATH, f"{safe_name}.md"),
+        "journal_path": os.path.join(asset_dir, f"{safe_name}{JOURNAL_SUFFIX}"),
+        "sections_path": os.path.join(asset_dir, f"{safe_name}{SECTIONS_SUFFIX}"),
+    }
 
-    #model, tokenizer = load(BASE_MODEL)
-    sections = parse_pdf_sections_robust(pdf_path, image_subfolder, full_image_path)
-    
-    intro_text = sections[0][1] + "\n" + (sections[1][1] if len(sections)>1 else "")
+def stage_file(paper: Dict, suffix: str) -> str:
+    return os.path.join(paper["asset_dir"], f"{paper['safe_name']}{suffix}")
 
-    concepts = extract_concepts(intro_text)
-    paper_title = extract_paper_title(paper_full_text, paper_name)
-    
-    if paper_title is None:
-        print("Failed to extract paper title")
+def convert_paper(paper: Dict) -> str:
+    """
+    Sets up the vault folders for one paper, copies the PDF and converts it to markdown.
+    """
+    os.makedirs(paper["asset_dir"], exist_ok=True)
+    if not (os.path.exists(paper["pdf_copy"]) and os.path.samefile(paper["pdf_path"], paper["pdf_copy"])):
+        shutil.copy(paper["pdf_path"], paper["pdf_copy"])
+    return pdf_to_markdown(paper["pdf_path"], paper["image_subfolder"], paper["asset_dir"])
+
+def prepare_paper(pdf_path: str, resume: bool = False, md_text: str = None) -> Dict:
+    """
+    convert_paper (unless md_text from an earlier parse/caption run is given), then
+    opens the paper's job journal and revision sidecar.
+    """
+    paper = paper_paths(pdf_path)
+    paper["md_text"] = convert_paper(paper) if md_text is None else md_text
+    paper["journal"] = PaperJournal.start(paper["journal_path"], paper["pdf_copy"], resume=resume)
+    paper["revision"] = SectionState(paper["sections_path"])
+    return paper
+
+GENERATION_PARAMS = {"max_tokens": 1000}
+
+# The adapters were trained on <= 2048 token examples (fineTune/trim_jsonl.py MAX_TOKENS),
+# chat headers, instruction and answer included. Section text gets what is left of that
+# once the answer (max_tokens) and the prompt around it are accounted for; longer sections
+# are split and map-reduced.
+TRAINED_MAX_TOKENS = 2048
+# Chat template headers (trim_jsonl.py keeps 100 for them) + the ~50 token style instruction
+PROMPT_OVERHEAD_TOKENS = 150
+MAX_SECTION_TOKENS = TRAINED_MAX_TOKENS - GENERATION_PARAMS["max_tokens"] - PROMPT_OVERHEAD_TOKENS
+# Answers that get reduced again (chunk answers, all but the last reduce round) are capped so
+# that two of them, which is what a reduce call merges at least, fit in MAX_SECTION_TOKENS too
+PARTIAL_PARAMS = dict(GENERATION_PARAMS, max_tokens=(MAX_SECTION_TOKENS - 1) // 2)
+
+REDUCE_PROMPT = """
+        These are explanations of consecutive parts of ONE section of a paper.
+        Merge them into a single explanation in the same style. Keep every [[WikiLink]], drop repetition.
+        """
+
+def explain_section(backend, config: Dict, content: str) -> str:
+    """
+    Map-reduce for long sections: split at subsection/paragraph boundaries so every
+    prompt stays in the token range the adapters were trained on, explain each chunk,
+    then merge the partial explanations with the same adapter.
+    """
+    # Same instruction in front of every chunk of every section: prefilled once per adapter
+    prefix = f"{config['prompt']}\n\nText:\n"
+    chunks = split_into_chunks(content, backend.count_tokens, MAX_SECTION_TOKENS)
+    params = PARTIAL_PARAMS if len(chunks) > 1 else GENERATION_PARAMS
+    partials = []
+    for i, chunk in enumerate(chunks):
+        if len(chunks) > 1:
+            print(f"   chunk {i + 1}/{len(chunks)}")
+        partials.append(backend.generate(prefix + chunk, prefix=prefix, **params))
+
+    return reduce_partials(partials, lambda merged, final: reduce_step(backend, merged, final), backend.count_tokens, MAX_SECTION_TOKENS)
+
+def reduce_step(backend, merged: str, final: bool = True) -> str:
+    prefix = f"{REDUCE_PROMPT}\n\nText:\n"
+    return backend.generate(prefix + merged, prefix=prefix, **(GENERATION_PARAMS if final else PARTIAL_PARAMS))
+
+def generate_batch_capped(backend, prompts: List[str], partial: List[bool], batch_size: int, prefix: str) -> List[str]:
+    """
+    backend.generate_batch with PARTIAL_PARAMS for the prompts whose answer gets reduced again.
+    """
+    outputs = [None] * len(prompts)
+    for capped in (False, True):
+        indices = [i for i, flag in enumerate(partial) if flag == capped]
+        if not indices:
+            continue
+        answers = backend.generate_batch(
+            [prompts[i] for i in indices], batch_size=batch_size, prefix=prefix,
+            **(PARTIAL_PARAMS if capped else GENERATION_PARAMS)
+        )
+        for i, answer in zip(indices, answers):
+            outputs[i] = answer
+    return outputs
+
+def explain_sections_batched(backend, config: Dict, contents: List[str], batch_size: int) -> List[str]:
+    """
+    explain_section for several sections at once: every chunk of every section goes through
+    backend.generate_batch together, then each round of the reduce is batched across sections.
+    """
+    prefix = f"{config['prompt']}\n\nText:\n"
+    chunked = [split_into_chunks(content, backend.count_tokens, MAX_SECTION_TOKENS) for content in contents]
+    outputs = iter(generate_batch_capped(
+        backend, [prefix + chunk for chunks in chunked for chunk in chunks],
+        [len(chunks) > 1 for chunks in chunked for _ in chunks], batch_size, prefix
+    ))
+    partials = [[next(outputs) for _ in chunks] for chunks in chunked]
+
+    reduce_prefix = f"{REDUCE_PROMPT}\n\nText:\n"
+    while any(len(parts) > 1 for parts in partials):
+        groups = [reduce_groups(parts, backend.count_tokens, MAX_SECTION_TOKENS) if len(parts) > 1 else None for parts in partials]
+        outputs = iter(generate_batch_capped(
+            backend, [reduce_prefix + group for section_groups in groups if section_groups for group in section_groups],
+            [len(section_groups) > 1 for section_groups in groups if section_groups for _ in section_groups],
+            batch_size, reduce_prefix
+        ))
+        partials = [
+            [next(outputs) for _ in section_groups] if section_groups else parts
+            for parts, section_groups in zip(partials, groups)
+        ]
+    return [parts[0] for parts in partials]
+
+def section_cache_key(style: str, content: str, backend) -> str:
+    return generation_cache_key(
+        style, STYLE_CONFIG[style]["prompt"], content,
+        dict(GENERATION_PARAMS, max_section_tokens=MAX_SECTION_TOKENS, partial_max_tokens=PARTIAL_PARAMS["max_tokens"]), backend
+    )
+
+# Fused mode: ONE base-model call per section returns every perspective as JSON, using the
+# panel prompt/schema the adapters' training data was generated with (fineTune/sdg.py)
+FUSED_PARAMS = {"max_tokens": 2000}
+
+def fused_cache_key(style: str, content: str, backend) -> str:
+    panel_prompt, _ = load_panel_spec()
+    return DiskCache.make_key(
+        backend=backend.cache_id,
+        base_model=BASE_MODEL,
+        prompt=panel_prompt,
+        style=style,
+        text=hash_text(content),
+        params=dict(FUSED_PARAMS, max_section_tokens=MAX_SECTION_TOKENS, partial_max_tokens=PARTIAL_PARAMS["max_tokens"]),
+    )
+
+def explain_section_fused(backend, content: str) -> Dict[str, str]:
+    """
+    One prefill per chunk for all perspectives. Long sections are still map-reduced, per style.
+    Raises ValueError when an answer doesn't match the schema.
+    """
+    panel_prompt, schema = load_panel_spec()
+    styles = [style for style in STYLE_CONFIG if style in schema["properties"]]
+    prefix = template_prefix(panel_prompt, "section_content")
+    backend.use_adapter(None)
+
+    chunks = split_into_chunks(content, backend.count_tokens, MAX_SECTION_TOKENS)
+    partials = {style: [] for style in styles}
+    for i, chunk in enumerate(chunks):
+        if len(chunks) > 1:
+            print(f"   chunk {i + 1}/{len(chunks)}")
+        answer = backend.generate(
+            panel_prompt.format(section_content=chunk), response_schema=schema, prefix=prefix, **FUSED_PARAMS
+        )
+        data = parse_panel_response(answer, schema)
+        for style in styles:
+            partials[style].append(format_perspective(style, data, schema))
+
+    return {
+        style: reduce_partials(parts, lambda merged, final: reduce_step(backend, merged, final), backend.count_tokens, MAX_SECTION_TOKENS)
+        for style, parts in partials.items()
+    }
+
+def section_known(paper: Dict, style: str, header: str, content: str, backend, cache: DiskCache = None) -> bool:
+    if paper["journal"].get(style, header, content) is not None:
+        return True
+    key = section_cache_key(style, content, backend)
+    return paper["revision"].get(key) is not None or (cache is not None and cache.get(key) is not None)
+
+def generate_fused(papers: List[Dict], backend, cache: DiskCache = None):
+    """
+    Pre-pass of generate_styles in fused mode: every section that still needs a perspective
+    is prefilled once instead of once per adapter. Results land in paper["fused"]
+    (by section text hash); sections whose answer fails the schema are left to the adapters.
+    """
+    _, schema = load_panel_spec()
+    styles = [style for style in STYLE_CONFIG if style in schema["properties"]]
+    print("Processing fused")
+
+    for paper in papers:
+        print(f"[{paper['safe_name']}]")
+        fused = paper.setdefault("fused", {})
+        for header, content in paper["sections"]:
+            content_hash = hash_text(content)
+            if is_skipped_section(header) or content_hash in fused:
+                continue
+            if all(section_known(paper, style, header, content, backend, cache) for style in styles):
+                continue
+
+            keys = {style: fused_cache_key(style, content, backend) for style in styles}
+            known = {}
+            for style, key in keys.items():
+                response = paper["revision"].get(key)
+                if response is None and cache is not None:
+                    response = cache.get(key)
+                if response is not None:
+                    known[style] = response
+            if len(known) == len(keys):
+                print(f"Cached {header}")
+                fused[content_hash] = known
+                continue
+
+            print(f"Working on {header}")
+            try:
+                with TRACER.span("fused_section", paper=paper["safe_name"], section=header, section_chars=len(content)):
+                    outputs = explain_section_fused(backend, content)
+            except Exception as e:
+                print(f"Fused answer unusable for {header} ({e}), falling back to the adapters")
+                continue
+
+            if cache is not None:
+                for style, key in keys.items():
+                    cache.put(key, outputs[style], meta={"style": style, "paper": paper["safe_name"], "section": header, "kind": "fused"})
+            fused[content_hash] = outputs
+
+def record_section(paper: Dict, style: str, header: str, content: str, key: str, response: str, source: str):
+    # Outputs new to this paper are linked against the vault once and kept linked in the journal
+    # and sidecar (the shared cache keeps the raw text), so an unchanged explanation renders byte
+    # for byte the same later on, whatever notes the vault gained in between
+    if source not in ("Done", "Unchanged"):
+        index = vault_index()
+        if index is not None:
+            response = index.link(response, exclude={paper["safe_name"]})
+    if source != "Done":
+        paper["journal"].record_result(style, header, content, response)
+    paper["revision"].record(key, response)
+    # A header that occurs twice (e.g. a stray "Abstract" before the real one) gets one block in
+    # the note: the last section's, for every style, so the callouts never mix two sections
+    if paper["note_sections"].get(header) != content:
         return
-    
-    with open(output_file, "w") as f:
-        f.write(f"# {paper_title}\n")
-        f.write(f"**Connected Concepts:** {concepts}\n\n")
-        f.write(f"[[assets/{safe_name}/{safe_name}.pdf|{safe_name}]] (PDF Source)\n\n---\n")
-    
-    style_content = {}
-    header_visuals = {}
+    paper["note"].add(header, style, response.replace("\n", "\n> "))
 
-    # --- VISUAL EXTRACTION LOOP ---
-    # Do this ONCE before loading models to save compute
-    print("🖼️ Extracting Visuals...")
+def generate_section(backend, style: str, paper: Dict, header: str, content: str, key: str, cache: DiskCache = None):
+    """
+    One section through the active adapter. Returns None (and journals the failure) if it fails.
+    """
+    try:
+        with TRACER.span("section", style=style, paper=paper["safe_name"], section=header, section_chars=len(content)):
+            # Cheap: the backend only swaps the adapter in on its first real generate()
+            backend.use_adapter(style)
+            response = explain_section(backend, STYLE_CONFIG[style], content)
+    except Exception as e:
+        print(f"Failed {style} on {header}: {e}")
+        paper["journal"].record_failure(style, header, str(e))
+        return None
+    if cache is not None:
+        cache.put(key, response, meta={"style": style, "paper": paper["safe_name"], "section": header})
+    return response
+
+# Sections handed to the batched path at once: enough to fill a few batches of similar
+# length, few enough that a crash only loses a little unjournaled work
+BATCH_WINDOW = 4
+
+def generate_pending(backend, style: str, pending: List[Tuple], batch_size: int, cache: DiskCache = None):
+    """
+    Batched generation of the (paper, header, content, key) sections of one style.
+    If a batch fails, its sections are retried one by one so a single bad section
+    doesn't take the others down with it.
+    """
+    backend.use_adapter(style)
+    window = batch_size * BATCH_WINDOW
+    for start in range(0, len(pending), window):
+        items = pending[start:start + window]
+        for paper, header, _, _ in items:
+            print(f"Working on {header} [{paper['safe_name']}]")
+        try:
+            with TRACER.span("section_batch", style=style, sections=len(items)):
+                responses = explain_sections_batched(backend, STYLE_CONFIG[style], [item[2] for item in items], batch_size)
+        except Exception as e:
+            print(f"Batch failed ({e}), retrying its sections one by one")
+            responses = [None] * len(items)
+            for i, (paper, header, content, key) in enumerate(items):
+                responses[i] = generate_section(backend, style, paper, header, content, key, cache)
+        else:
+            if cache is not None:
+                for (paper, header, _, key), response in zip(items, responses):
+                    cache.put(key, response, meta={"style": style, "paper": paper["safe_name"], "section": header})
+
+        for (paper, header, content, key), response in zip(items, responses):
+            if response is not None:
+                record_section(paper, style, header, content, key, response, "Generated")
+
+def generate_styles(papers: List[Dict], backend, cache: DiskCache = None, fused: bool = False, batch_size: int = 1,
+                    offline: bool = False):
+    """
+    Adapter-major scheduling: each adapter is swapped in ONCE and runs over every
+    section of every paper before moving on to the next one.
+    Answers already in the paper's journal (--resume), unchanged since the previous
+    version of the paper, or in the cache are reused, and an adapter whose sections
+    are all done is never swapped in at all.
+    With fused=True, generate_fused answers every perspective first and the adapters
+    only handle what it couldn't. With batch_size > 1, the sections still missing for a
+    style are decoded batch_size at a time (across papers) instead of one by one.
+    offline=True only reuses answers and leaves the rest out (render command): no model is loaded.
+    """
+    if fused and not offline:
+        generate_fused(papers, backend, cache)
+
+    for style in GENERATION_ORDER:
+        print(f"Processing {style}")
+        pending = []
+
+        for paper in papers:
+            print(f"[{paper['safe_name']}]")
+            journal = paper["journal"]
+            revision = paper["revision"]
+            for header, content in paper["sections"]:
+                if is_skipped_section(header):
+                    print(f"Skipping {header}")
+                    continue
+
+                fused_outputs = paper.get("fused", {}).get(hash_text(content), {})
+                if style in fused_outputs:
+                    key = fused_cache_key(style, content, backend)
+                else:
+                    key = section_cache_key(style, content, backend)
+                response = journal.get(style, header, content)
+                source = "Done"
+                if response is None:
+                    response = revision.get(key)
+                    source = "Unchanged"
+                if response is None and style in fused_outputs:
+                    response = fused_outputs[style]
+                    source = "Fused"
+                if response is None and cache is not None:
+                    response = cache.get(key)
+                    source = "Cached"
+
+                if response is not None:
+                    print(f"{source} {header}")
+                elif offline:
+                    print(f"Not generated yet {header}")
+                    # Generated before, but for a different text: the note has a block we'd lose
+                    if paper["note_sections"].get(header) == content and journal.has_output(style, header):
+                        paper.setdefault("missing", []).append((style, header))
+                    continue
+                elif batch_size > 1:
+                    pending.append((paper, header, content, key))
+                    continue
+                else:
+                    print(f"Working on {header}")
+                    response = generate_section(backend, style, paper, header, content, key, cache)
+                    if response is None:
+                        continue
+
+                record_section(paper, style, header, content, key, response, source)
+
+            # Executive brain is also the one used for concept extraction
+            if style == "executive":
+                key = concepts_cache_key(paper["intro_text"], backend)
+                concepts = journal.get("concepts", "", paper["intro_text"])
+                if concepts is None:
+                    concepts = revision.get(key)
+                    if concepts is None and offline:
+                        concepts = cache.get(key) if cache is not None else None
+                        if concepts is None:
+                            if journal.has_output("concepts", ""):
+                                paper.setdefault("missing", []).append(("concepts", ""))
+                            continue
+                    if concepts is None:
+                        try:
+                            with TRACER.span("concepts", paper=paper["safe_name"]):
+                                concepts = extract_concepts(
+                                    paper["intro_text"], backend, cache, vault_index(), {paper["safe_name"]}
+                                )
+                        except Exception as e:
+                            print(f"Failed concepts: {e}")
+                            journal.record_failure("concepts", "", str(e))
+                            continue
+                    journal.record_result("concepts", "", paper["intro_text"], concepts)
+                revision.record(key, concepts)
+                paper["note"].set_concepts(concepts)
+
+        if pending:
+            generate_pending(backend, style, pending, batch_size, cache)
+
+    for paper in papers:
+        paper.pop("fused", None)
+
+def write_note(paper: Dict):
+    """
+    Final render. The note has been written incrementally during generation already;
+    this flushes the last sections and drops the spool file.
+    """
+    print(f"Writing {paper['output_file']}")
+    paper["note"].close()
+
+def parse_stage(pdf_path: str, vision, caption_cache: DiskCache, resume: bool = False) -> Dict:
+    """
+    Everything CPU-bound for one paper: PDF -> markdown, image hashing and caption cache lookups.
+    Runs on the prefetch thread while the models work on the previous paper.
+    """
+    print(f"📄 Parsing {pdf_path}")
+    with TRACER.span("parse", pdf=os.path.basename(pdf_path)) as span:
+        paper = prepare_paper(pdf_path, resume=resume)
+        paper["caption_plan"] = plan_captions(
+            paper["md_text"], OBSIDIAN_VAULT_PATH, vision, caption_cache, known=paper["revision"].known_captions
+        )
+        span.set(markdown_chars=len(paper["md_text"]))
+    return paper
+
+def keep_captions(paper: Dict, vision):
+    """
+    For commands that don't caption (generate, render): records the sidecar captions of the
+    images the markdown still links, so saving the sidecar doesn't forget them.
+    Hashes the images, no model is loaded.
+    """
+    known = paper["revision"].known_captions
+    plan = plan_captions(paper["md_text"], OBSIDIAN_VAULT_PATH, vision, known=known) if known else None
+    if plan is not None:
+        paper["revision"].record_captions({key: known[key] for key in plan["keys"].values() if key in known})
+
+def split_stage(paper: Dict, backend, preview: bool = True):
+    """
+    preview=False (render) doesn't touch the existing note until write_note: a render that
+    can't resolve every section must be able to leave it alone.
+    """
+    with TRACER.span("split", paper=paper["safe_name"]) as span:
+        _split_stage(paper, backend, preview)
+        span.set(sections=len(paper["sections"]), **{f"prompt_tokens_{k}": v for k, v in paper.get("prompt_tokens", {}).items()})
+
+def compress_sections(paper: Dict, sections: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    The sections as the LLM sees them (utils/prompt_compression.py), with the tokens saved per section.
+    Everything downstream (prompts, cache keys, journal) uses the compressed text.
+    """
+    if not COMPRESSION:
+        return sections
+    references = reference_numbers(paper["md_text"])
+    compressed = []
+    before = after = 0
     for header, content in sections:
+        if is_skipped_section(header):
+            compressed.append((header, content))
+            continue
+        short = compress_section(content, references=references)
+        compressed.append((header, short))
+        tokens, kept = estimate_tokens(content), estimate_tokens(short)
+        before, after = before + tokens, after + kept
+        if kept < tokens:
+            print(f"   🗜️ {header}: ~{tokens - kept} tokens saved ({tokens} -> {kept})")
+    paper["prompt_tokens"] = {"before": before, "after": after}
+    if before:
+        print(f"🗜️ Prompts ~{before - after}/{before} tokens smaller ({100 * (before - after) / before:.0f}%) [{', '.join(COMPRESSION)}]")
+    return compressed
+
+def _split_stage(paper: Dict, backend, preview: bool = True):
+    raw_sections = split_markdown_sections(paper["md_text"])
+    sections = compress_sections(paper, raw_sections)
+    paper["sections"] = sections
+    paper["note_sections"] = dict(sections)  # header -> content of its last section
+    paper["title"] = extract_paper_title(paper["md_text"], paper["paper_name"])
+    paper["intro_text"] = (sections[0][1] if sections else "") + "\n" + (sections[1][1] if len(sections)>1 else "")
+
+    # Revised paper? Report how much of the previous version can be reused
+    revision = paper["revision"]
+    if revision.previous["outputs"]:
+        kept = [header for header, content in sections if not is_skipped_section(header)]
+        unchanged = sum(
+            1 for header, content in sections if not is_skipped_section(header)
+            and any(
+                revision.count_unchanged(make_key(style, content, backend) for style in STYLE_CONFIG) == len(STYLE_CONFIG)
+                for make_key in (section_cache_key, fused_cache_key)
+            )
+        )
+        print(f"♻️ {unchanged}/{len(kept)} sections unchanged since the previous version")
+
+    # Do this ONCE before loading models to save compute
+    header_visuals = {}
+    for header, content in dict(raw_sections).items():
         visuals = extract_visuals_only(content)
         if visuals:
             header_visuals[header] = visuals
 
-    for style, config in STYLE_CONFIG.items():
-        print(f"Processing {style}")
+    # Partial note shows up in the vault right away and fills in as styles finish
+    note = NoteWriter(
+        paper["output_file"], paper["title"], paper["safe_name"],
+        [header for header, _ in sections if not is_skipped_section(header)],
+        header_visuals, STYLE_CONFIG, flush_interval=2.0 if preview else float("inf"),
+    )
+    if preview:
+        note.flush()
+    paper["note"] = note
+
+RELATED_PAPERS = 5
+
+def link_related(paper: Dict):
+    """
+    Adds the paper's sections to the vault's vector index and lists its closest papers in the note.
+    """
+    from utils.related import RELATED_INDEX, load_related_index
+
+    if not RELATED_INDEX:
+        return
+    index = load_related_index(OBSIDIAN_VAULT_PATH)
+    with TRACER.span("related", paper=paper["safe_name"]):
+        sections = [(header, content) for header, content in paper["sections"] if not is_skipped_section(header)]
+        index.add_paper(paper["safe_name"], paper["title"], sections)
+        paper["note"].set_related(index.related(paper["safe_name"], RELATED_PAPERS))
+
+def write_stage(paper: Dict):
+    with TRACER.span("render", paper=paper["safe_name"]):
+        link_related(paper)
+        write_note(paper)
+        paper["revision"].save()
+        journal = paper["journal"]
+        journal.mark_done()
+    print(f"✅ {paper['output_file']}")
+
+    # Make gaps loud instead of silently missing callouts
+    for (style, header), error in journal.failures.items():
+        where = f" for '{header}'" if header else ""
+        print(f"   ⚠️ missing {style}{where}: {error}")
+    if journal.failures:
+        print(f"   Re-run with --resume to retry only the {len(journal.failures)} missing results")
+
+def keep_models_resident(backend, vision, max_resident_models: int = None) -> bool:
+    """
+    Whether the VLM and the LLM (+ draft) stay loaded together. Decided by the memory budget
+    unless max_resident_models is given; models on a server don't count against it, and the
+    old one-at-a-time policy is kept for them.
+    """
+    if max_resident_models is not None:
+        return max_resident_models >= 2
+    models = getattr(vision, "resident_models", None), getattr(backend, "resident_models", None)
+    if None in models:
+        return False
+    models = models[0] + models[1]
+    needed = sum(RESIDENCY.footprint(name, model_id) for name, model_id in models)
+    together = RESIDENCY.fits(models)
+    print(f"🧠 {' + '.join(name for name, _ in models)} need ~{needed / GB:.1f} GB, budget {RESIDENCY.budget / GB:.1f} GB: "
+          + ("keeping them loaded together" if together else "one model at a time"))
+    return together
+
+def process_papers(pdf_paths: List[str], backend_kind: str = "mlx", max_resident_models: int = None,
+                   queue_size: int = 2, resume: bool = False, fused: bool = False, batch_size: int = 1,
+                   speculative: List[str] = None, draft_model: str = DRAFT_MODEL, num_draft_tokens: int = 2,
+                   backends: Tuple = None) -> List[str]:
+    """
+    Staged pipeline. Parsing (and image hashing) runs on a background thread, at most
+    queue_size papers ahead of the models, and notes are written on another thread.
+    All model inference stays on this thread.
+
+    One model at a time (16GB machines): the VLM captions every paper as it arrives,
+    is unloaded, then the adapters run adapter-major over all papers.
+    Models resident together: VLM and base LLM stay loaded and each paper is captioned
+    and generated as soon as it is parsed (adapters are hot-swapped per paper).
+    max_resident_models=None picks one by the memory budget (keep_models_resident), 1 / 2+ forces it.
+
+    backends=(text, vision) reuses long-lived backends (daemon mode): the text model is then
+    left loaded for the next call. Returns the PDFs that failed to parse, caption or split;
+    a failing paper doesn't stop the others.
+    """
+    caption_cache = DiskCache("captions")
+    generation_cache = DiskCache("generations")
+    # MLX: base weights stay resident, only the LoRA deltas get swapped per style
+    owns_backends = backends is None
+    if owns_backends:
+        backends = make_backends(
+            backend_kind, BASE_MODEL, ADAPTERS, VISION_MODEL,
+            draft_model=draft_model if speculative else None, draft_styles=speculative, num_draft_tokens=num_draft_tokens,
+        )
+    backend, vision = backends
+    writer = BackgroundWorker(write_stage, queue_size=queue_size, name="note-writer")
+    streaming = keep_models_resident(backend, vision, max_resident_models)
+
+    papers = []
+    failed = []
+    try:
+        for pdf_path, paper, error in prefetch(lambda p: parse_stage(p, vision, caption_cache, resume), pdf_paths, queue_size):
+            if error is not None:
+                print(f"Failed to parse {pdf_path}: {error}")
+                failed.append(pdf_path)
+                continue
+
+            try:
+                # --- CAPTION (vision model loaded at most once) ---
+                plan = paper.pop("caption_plan")
+                if plan is not None:
+                    with TRACER.span("caption_paper", paper=paper["safe_name"], images=plan["links"],
+                                     new_images=len(plan["pending"]), skipped_images=len(plan["skipped"])):
+                        captions = run_captions(plan, vision, caption_cache)
+                        paper["revision"].record_captions({plan["keys"][path]: text for path, text in captions.items()})
+                        paper["md_text"] = inject_captions(paper["md_text"], captions)
+                # render starts from this, so it sees the same section texts as this run
+                save_stage_output(paper, CAPTIONED_SUFFIX, paper["md_text"])
+
+                # --- SPLIT SECTIONS + VISUALS ---
+                split_stage(paper, backend)
+            except Exception as e:
+                print(f"Failed to prepare {pdf_path}: {e}")
+                failed.append(pdf_path)
+                continue
+
+            if streaming:
+                with TRACER.span("generate_paper", paper=paper["safe_name"]):
+                    generate_styles([paper], backend, generation_cache, fused, batch_size)
+                writer.submit(paper)
+            else:
+                papers.append(paper)
+
+        # With room for both models, a long-lived VLM stays warm for the next call
+        if owns_backends or not streaming:
+            vision.unload()
+
+        # --- ADAPTER-MAJOR GENERATION ---
+        if papers:
+            with TRACER.span("generate_batch", papers=len(papers)):
+                generate_styles(papers, backend, generation_cache, fused, batch_size)
+            for paper in papers:
+                writer.submit(paper)
+    finally:
+        # Notes already queued still get written, and models don't outlive a crashed run
+        writer.close()
+        if owns_backends or not streaming:
+            vision.unload()
+        if owns_backends:
+            backend.unload()
+    return failed
+
+def watch_inbox(inbox: str, backend_kind: str = "mlx", idle_timeout: float = 600, poll_interval: float = 2.0,
+                max_batch: int = 4, status_port: int = None, speculative: List[str] = None,
+                draft_model: str = DRAFT_MODEL, num_draft_tokens: int = 2, **options):
+    """
+    Daemon mode: imports and models stay loaded between papers, so a PDF dropped into
+    the inbox starts within a poll interval. Models are dropped after idle_timeout seconds.
+    """
+    backends = make_backends(
+        backend_kind, BASE_MODEL, ADAPTERS, VISION_MODEL,
+        draft_model=draft_model if speculative else None, draft_styles=speculative, num_draft_tokens=num_draft_tokens,
+    )
+
+    def unload_models():
+        for model in backends:
+            model.unload()
+
+    run_daemon(
+        inbox,
+        lambda pdf_paths: process_papers(pdf_paths, backend_kind, backends=backends, **options),
+        unload_models,
+        idle_timeout=idle_timeout,
+        poll_interval=poll_interval,
+        max_batch=max_batch,
+        status_port=status_port,
+    )
+
+def require_vault() -> str:
+    """
+    Only commands that touch the vault need it, so it is checked here instead of at import.
+    """
+    if not OBSIDIAN_VAULT_PATH:
+        raise SystemExit("OBSIDIAN_VAULT_PATH is not set (.env or environment); set it or pass --vault")
+    if not os.path.isdir(OBSIDIAN_VAULT_PATH):
+        raise SystemExit(f"OBSIDIAN_VAULT_PATH {OBSIDIAN_VAULT_PATH} is not a directory")
+    return OBSIDIAN_VAULT_PATH
+
+def config_problems(args) -> List[str]:
+    """
+    Settings a model command would otherwise trip over halfway through a run.
+    """
+    problems = []
+    # Every backend hashes the adapter weights into its cache keys
+    for style, path in ADAPTERS.items():
+        if not os.path.exists(os.path.join(path, "adapters.safetensors")):
+            problems.append(f"adapter '{style}' not found at {path} (run from the repo root)")
+    if args.backend == "openai":
         try:
-            model, tokenizer = load(BASE_MODEL, adapter_path=ADAPTERS[style])
+            json.loads(os.environ.get("PAPER_OPENAI_ADAPTER_MODELS", "{}"))
+        except ValueError as e:
+            problems.append(f"PAPER_OPENAI_ADAPTER_MODELS is not valid JSON: {e}")
+    unknown = check_steps()
+    if unknown:
+        problems.append(f"PAPER_PROMPT_COMPRESSION: unknown step(s) {', '.join(unknown)}")
+    if "batch_size" in args:
+        if args.batch_size < 1:
+            problems.append("--batch-size must be at least 1")
+        if args.num_draft_tokens < 1:
+            problems.append("--num-draft-tokens must be at least 1")
+        unknown = set(args.speculative) - set(STYLE_CONFIG) - {"base", "all"}
+        if unknown:
+            problems.append(f"--speculative: unknown style(s) {', '.join(sorted(unknown))}")
+    return problems
 
-            # CRITICAL: Set EOS token for Llama 3
-            if "<|eot_id|>" in tokenizer.get_vocab():
-                tokenizer.eos_token_id = tokenizer.convert_tokens_to_ids("<|eot_id|>")
+def load_stage_output(paper: Dict, suffix: str) -> str:
+    """
+    Markdown saved by an earlier parse / caption command, unless the PDF is newer.
+    """
+    path = stage_file(paper, suffix)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(paper["pdf_path"]):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
 
-            for header,content in sections:
-                if any(x in header.lower() for x in ["reference", "citation", "acknowledg","bibliography"]):
-                    print(f"Skipping {header}")
-                    continue
-                print(f"Working on {header}")
-                prompt_text = f"{config['prompt']}\n\nText:\n{content}"
-                messages = [{"role": "user", "content": prompt_text}]
-                
-                prompt = tokenizer.apply_chat_template(messages, add_generation_prompt=True)
-                response = generate(model, tokenizer, prompt=prompt, max_tokens=1000)
-
-                cleaned_response = response.replace("\n", "\n> ")
-                if header not in style_content:
-                    style_content[header] = {}
-                style_content[header][style] = cleaned_response
-        except Exception as e:  
-            print(f"Failed {style}: {e}")
+def save_stage_output(paper: Dict, suffix: str, md_text: str):
+    path = stage_file(paper, suffix)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(md_text)
+    return path
+
+def parse_command(pdf_paths: List[str]) -> List[str]:
+    """
+    PDF -> markdown + images in the vault, no models. Returns the PDFs that failed.
+    """
+    failed = []
+    for pdf_path in pdf_paths:
+        print(f"📄 Parsing {pdf_path}")
+        paper = paper_paths(pdf_path)
+        try:
+            with TRACER.span("parse", pdf=os.path.basename(pdf_path)):
+                md_text = convert_paper(paper)
+        except Exception as e:
+            print(f"Failed to parse {pdf_path}: {e}")
+            failed.append(pdf_path)
             continue
-    
-    for header in style_content:
-        print(f"Writing {header}")
-        if any(x in header.lower() for x in ["reference", "citation", "acknowledg","bibliography"]):
+        path = save_stage_output(paper, PARSED_SUFFIX, md_text)
+        print(f"✅ {len(split_markdown_sections(md_text))} sections -> {path}")
+    return failed
+
+def caption_command(pdf_paths: List[str], backend_kind: str) -> List[str]:
+    """
+    Captions the images of parsed papers (parsing first where needed). Only the VLM is loaded.
+    """
+    _, vision = make_backends(backend_kind, BASE_MODEL, ADAPTERS, VISION_MODEL)
+    cache = DiskCache("captions")
+    failed = []
+    for pdf_path in pdf_paths:
+        paper = paper_paths(pdf_path)
+        md_text = load_stage_output(paper, PARSED_SUFFIX)
+        if md_text is None:
+            failed += parse_command([pdf_path])
+            md_text = load_stage_output(paper, PARSED_SUFFIX)
+            if md_text is None:
+                continue
+        revision = SectionState(paper["sections_path"])
+        plan = plan_captions(md_text, OBSIDIAN_VAULT_PATH, vision, cache, known=revision.known_captions)
+        if plan is not None:
+            with TRACER.span("caption_paper", paper=paper["safe_name"], images=plan["links"], new_images=len(plan["pending"]),
+                             skipped_images=len(plan["skipped"])):
+                captions = run_captions(plan, vision, cache)
+                md_text = inject_captions(md_text, captions)
+            # A revised paper then only sends images with new bytes to the VLM, as in run
+            revision.record_captions({plan["keys"][path]: text for path, text in captions.items()})
+            revision.keep_outputs()
+            revision.save()
+        print(f"✅ {save_stage_output(paper, CAPTIONED_SUFFIX, md_text)}")
+    vision.unload()
+    return failed
+
+def generate_command(pdf_paths: List[str], backend_kind: str, resume: bool = False, fused: bool = False,
+                     batch_size: int = 1, speculative: List[str] = None, draft_model: str = DRAFT_MODEL,
+                     num_draft_tokens: int = 2, offline: bool = False) -> List[str]:
+    """
+    Generates (or, offline=True, just re-renders) the notes of papers, starting from the
+    captioned or parsed markdown of earlier commands when there is some. offline never loads a model.
+    """
+    # The VLM is never loaded here: it only names the caption keys for keep_captions
+    backend, vision = make_backends(
+        backend_kind, BASE_MODEL, ADAPTERS, VISION_MODEL,
+        draft_model=draft_model if speculative else None, draft_styles=speculative, num_draft_tokens=num_draft_tokens,
+    )
+    papers = []
+    failed = []
+    for pdf_path in pdf_paths:
+        stage = paper_paths(pdf_path)
+        md_text = load_stage_output(stage, CAPTIONED_SUFFIX)
+        if md_text is None:
+            md_text = load_stage_output(stage, PARSED_SUFFIX)
+            if md_text is not None:
+                print(f"{stage['safe_name']}: images not captioned (run caption first to add them)")
+        if md_text is None and offline and not os.path.exists(stage["journal_path"]):
+            print(f"{stage['safe_name']}: nothing generated yet, skipping")
+            continue
+        try:
+            # Rendering only reads results, so it always picks up the journal
+            paper = prepare_paper(pdf_path, resume=resume or offline, md_text=md_text)
+        except Exception as e:
+            print(f"Failed to parse {pdf_path}: {e}")
+            failed.append(pdf_path)
             continue
+        if md_text is None:
+            # As in run: a later render must see the same section texts, not a fresh parse
+            save_stage_output(paper, PARSED_SUFFIX, paper["md_text"])
+        keep_captions(paper, vision)
+        split_stage(paper, backend, preview=not offline)
+        papers.append(paper)
 
-        with open(output_file, "a") as f:
-            f.write(f"\n## {header}\n")
-            
-            if header in header_visuals:
-                f.write("> [!ABSTRACT]- Visuals (Click to expand)\n")
-                for vis in header_visuals[header]:
-                    indented_vis = vis.replace("\n", "\n> ")
-                    f.write(f"> {indented_vis}\n> \n")
-                f.write("---\n") # Separator line
-
-            for style, config in STYLE_CONFIG.items():
-                try:
-                    f.write(f"{config['callout']}\n")
-                    f.write(f"> {style_content[header][style]}\n\n")
-                    
-                except Exception as e:
-                    print(f"Failed {style}: {e}")
-                    continue
-            
-            
-if __name__ == "__main__":
-    main()
-    
+    if papers:
+        with TRACER.span("generate_batch", papers=len(papers)):
+            generate_styles(papers, backend, DiskCache("generations"), fused, batch_size, offline=offline)
+    for paper in papers:
+        if offline:
+            missing = paper.get("missing", [])
+            if missing and os.path.exists(paper["output_file"]):
+                # The text no longer matches what was generated (e.g. re-parsed differently):
+                # rewriting would drop those blocks from the note and the sidecar
+                style, header = missing[0]
+                print(f"⚠️ {paper['safe_name']}: {len(missing)} outputs not found for the current text "
+                      f"(e.g. {style} of '{header}'), leaving {paper['output_file']} as it is. Run generate to fill them in.")
+                paper["note"].discard()
+                failed.append(paper["pdf_path"])
+                continue
+            # Not marked done: the journal still lists what is missing for --resume
+            link_related(paper)
+            write_note(paper)
+            paper["revision"].save()
+            print(f"✅ {paper['output_file']}")
+        else:
+            write_stage(paper)
+    backend.unload()
+    return failed
+
+def status_command(inbox: str = None):
+    """
+    Where every paper in the vault is (parsed, captioned, unfinished, done) and what the daemon is doing.
+    """
+    vault = require_vault()
+    rows = []
+    for asset_dir in sorted(glob.glob(os.path.join(vault, "assets", "*"))):
+        safe_name = os.path.basename(asset_dir)
+        journal_path = os.path.join(asset_dir, f"{safe_name}{JOURNAL_SUFFIX}")
+        if os.path.exists(journal_path):
+            journal = PaperJournal.read(journal_path)
+            if journal.done and journal.failures:
+                state = f"⚠️ done, {len(journal.failures)} missing"
+            elif journal.done:
+                state = "✅ done"
+            else:
+                state = f"⏳ unfinished, {len(journal.results)} results"
+        elif os.path.exists(os.path.join(asset_dir, f"{safe_name}{CAPTIONED_SUFFIX}")):
+            state = "captioned"
+        elif os.path.exists(os.path.join(asset_dir, f"{safe_name}{PARSED_SUFFIX}")):
+            state = "parsed"
+        else:
+            continue
+        rows.append((safe_name, state))
+
+    print(f"{len(rows)} papers in {vault}")
+    for safe_name, state in rows:
+        print(f"  {state:<28} {safe_name}")
+
+    status_path = os.path.join(inbox or os.path.join(vault, "inbox"), DAEMON_STATUS_FILE)
+    if os.path.exists(status_path):
+        with open(status_path, "r") as f:
+            daemon = json.load(f)
+        state = daemon["state"]
+        if state != "stopped":
+            try:
+                os.kill(daemon["pid"], 0)
+            except ProcessLookupError:
+                state = "not running"
+            except PermissionError:
+                pass
+        print(f"\nDaemon (pid {daemon['pid']}): {state}, {daemon['processed']} processed, {daemon['failed']} failed")
+        if daemon["current"]:
+            print(f"  working on {', '.join(daemon['current'])}")
+        if daemon["queue"]:
+            print(f"  {len(daemon['queue'])} waiting")
+
+COMMANDS = ("run", "parse", "caption", "generate", "render", "status")
+
+def build_parser() -> argparse.ArgumentParser:
+    vault = argparse.ArgumentParser(add_help=False)
+    vault.add_argument("--vault", help="Obsidian vault folder (default OBSIDIAN_VAULT_PATH from .env)")
+
+    tracing = argparse.ArgumentParser(add_help=False)
+    tracing.add_argument(
+        "--trace", default=os.environ.get("PAPER_TRACE"),
+        help="Write per-stage / per-model-call metrics as JSON lines (summarize with python -m utils.tracing FILE)"
+    )
+    tracing.add_argument(
+        "--chrome-trace", default=os.environ.get("PAPER_CHROME_TRACE"),
+        help="Write a Chrome trace-event file (open in chrome://tracing or ui.perfetto.dev)"
+    )
+
+    models = argparse.ArgumentParser(add_help=False)
+    models.add_argument(
+        "--backend", choices=BACKENDS, default=os.environ.get("PAPER_BACKEND", "mlx"),
+        help="Inference backend: mlx (default), openai (local OpenAI-compatible server) or stub (deterministic, any OS)"
+    )
+
+    generation = argparse.ArgumentParser(add_help=False)
+    generation.add_argument("paths", nargs="*", help="PDF files and/or directories of PDFs")
+    generation.add_argument(
+        "--fused", action="store_true",
+        help="One base-model call per section for all perspectives (JSON), falling back to the adapters when it can't be parsed"
+    )
+    generation.add_argument(
+        "--batch-size", type=int, default=int(os.environ.get("PAPER_BATCH_SIZE", "1")),
+        help="Sections decoded together per adapter (1 = one at a time). 4-8 raises throughput if memory allows."
+    )
+    generation.add_argument(
+        "--speculative", default=os.environ.get("PAPER_SPECULATIVE", ""),
+        help=f"Speculative decoding for these styles, comma separated ({', '.join(STYLE_CONFIG)}, base, or all)"
+    )
+    generation.add_argument("--draft-model", default=DRAFT_MODEL, help="Draft model for --speculative (same tokenizer)")
+    generation.add_argument("--num-draft-tokens", type=int, default=2, help="Tokens the draft proposes per step")
+    generation.add_argument(
+        "--resume", action="store_true",
+        help="Reuse finished results from each paper's job journal. Without paths, resumes every unfinished run in the vault."
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Turn research papers into Obsidian notes",
+        epilog="Without a command, run is assumed: obsidian_paper.py paper.pdf [options]",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    run = commands.add_parser(
+        "run", parents=[vault, models, generation, tracing], help="Whole pipeline: parse, caption, generate, render (default)"
+    )
+    run.add_argument(
+        "--max-resident-models", type=int, default=None,
+        help="How many models (VLM, base LLM) may be in memory at once. 2+ overlaps captioning with generation. "
+             "Default: whatever fits the memory budget (PAPER_MEMORY_BUDGET_GB)"
+    )
+    run.add_argument(
+        "--watch", action="store_true",
+        help="Daemon mode: keep models warm and process PDFs dropped into the inbox (urgent/ and later/ set priority)"
+    )
+    run.add_argument("--inbox", default=os.environ.get("PAPER_INBOX"), help="Inbox folder for --watch (default <vault>/inbox)")
+    run.add_argument("--idle-timeout", type=float, default=600, help="--watch: unload models after this many idle seconds")
+    run.add_argument("--poll-interval", type=float, default=2.0, help="--watch: seconds between inbox scans")
+    run.add_argument("--status-port", type=int, help="--watch: also serve the status JSON on 127.0.0.1:PORT")
+    run.add_argument("--dry-run", action="store_true", help="List what would be processed and exit")
+
+    parse = commands.add_parser("parse", parents=[vault, tracing], help="PDF -> markdown and images only, no models")
+    parse.add_argument("paths", nargs="+", help="PDF files and/or directories of PDFs")
+
+    caption = commands.add_parser("caption", parents=[vault, models, tracing], help="Caption the images of parsed papers")
+    caption.add_argument("paths", nargs="+", help="PDF files and/or directories of PDFs")
+
+    commands.add_parser(
+        "generate", parents=[vault, models, generation, tracing],
+        help="Generate notes from parsed / captioned papers (parses what isn't yet)"
+    )
+
+    render = commands.add_parser(
+        "render", parents=[vault, models, tracing], help="Rewrite notes from finished results, without loading a model"
+    )
+    render.add_argument("paths", nargs="+", help="PDF files and/or directories of PDFs")
 
+    status = commands.add_parser("status", parents=[vault], help="Show every paper's state and the daemon's")
+    status.add_argument("--inbox", default=os.environ.get("PAPER_INBOX"), help="Daemon inbox (default <vault>/inbox)")
+    return parser
 
-    
\ No newline at end of file
+def main(argv: List[str] = None):
+    global OBSIDIAN_VAULT_PATH
+
+    argv = sys.argv[1:] if argv is None else argv
+    # Old style "obsidian_paper.py paper.pdf --resume" still means run
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ("-h", "--help")):
+        argv = ["run"] + argv
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.vault:
+        OBSIDIAN_VAULT_PATH = args.vault
+    require_vault()
+
+    if args.command == "status":
+        status_command(args.inbox)
+        return
+
+    if "speculative" in args:
+        args.speculative = [style.strip() for style in args.speculative.split(",") if style.strip()]
+    if args.command != "parse":
+        problems = config_problems(args)
+        if problems:
+            parser.error("; ".join(problems))
+
+    if args.command == "run" and args.watch:
+        TRACER.configure(args.trace, args.chrome_trace)
+        try:
+            watch_inbox(
+                args.inbox or os.path.join(OBSIDIAN_VAULT_PATH, "inbox"), args.backend,
+                idle_timeout=args.idle_timeout, poll_interval=args.poll_interval, status_port=args.status_port,
+                speculative=args.speculative, draft_model=args.draft_model, num_draft_tokens=args.num_draft_tokens,
+                max_resident_models=args.max_resident_models, resume=args.resume, fused=args.fused,
+                batch_size=args.batch_size,
+            )
+        finally:
+            TRACER.close()
+        return
+
+    if args.paths:
+        pdf_paths = collect_pdfs(args.paths)
+    elif args.resume:
+        pdf_paths = unfinished_journals(OBSIDIAN_VAULT_PATH)
+    else:
+        parser.error("give at least one PDF or directory (or --resume / --watch)")
+    if not pdf_paths:
+        print("Nothing to process")
+        return
+    if args.command == "run" and args.dry_run:
+        print(f"Would process {len(pdf_paths)} PDFs:")
+        for pdf_path in pdf_paths:
+            print(f"  {pdf_path} -> {paper_paths(pdf_path)['output_file']}")
+        return
+
+    TRACER.configure(args.trace, args.chrome_trace)
+    try:
+        if args.command == "parse":
+            failed = parse_command(pdf_paths)
+        elif args.command == "caption":
+            failed = caption_command(pdf_paths, args.backend)
+        elif args.command == "render":
+            failed = generate_command(pdf_paths, args.backend, offline=True)
+        elif args.command == "generate":
+            failed = generate_command(
+                pdf_paths, args.backend, resume=args.resume, fused=args.fused, batch_size=args.batch_size,
+                speculative=args.speculative, draft_model=args.draft_model, num_draft_tokens=args.num_draft_tokens,
+            )
+        else:
+            failed = process_papers(
+                pdf_paths, backend_kind=args.backend, max_resident_models=args.max_resident_models,
+                resume=args.resume, fused=args.fused, batch_size=args.batch_size,
+                speculative=args.speculative, draft_model=args.draft_model, num_draft_tokens=args.num_draft_tokens,
+            )
+    finally:
+        TRACER.close()
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,607 @@
+"""
+Inference backends. Every model call in the pipeline goes through one of these:
+
+  text:   use_adapter(name) -> selects the persona (None = plain base model)
+          generate(prompt_text, max_tokens=..., response_schema=None, prefix=None, **params) -> str
+                   (prompt_text is the user message; response_schema asks for JSON output
+                   where the backend can enforce it, otherwise the prompt has to; prefix is
+                   the leading part of prompt_text shared by many calls, worth caching)
+          generate_batch(prompt_texts, max_tokens=..., batch_size=..., **params) -> [str]
+                   (several prompts through the active adapter together, same order back)
+          count_tokens(text) -> int
+  vision: caption(image_path, prompt, max_tokens=..., **params) -> str
+
+Both have unload() and a cache_id that goes into the cache keys, so answers from
+different backends never get mixed up. Backends whose models live in this process list
+them in resident_models [(name, model_id)] and load them through RESIDENCY, which
+unloads the least recently used ones when memory runs short.
+"""
+
+import base64
+import copy
+import hashlib
+import json
+import mimetypes
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.residency import GB, RESIDENCY, mlx_active_memory
+from utils.tracing import TRACER, repetition_ratio
+
+
+BACKENDS = ["mlx", "openai", "stub"]
+
+
+def _generation_stats(text: str, generated_tokens: int, max_tokens: int, seconds: float) -> dict:
+    """
+    Attributes every traced generate span gets, whatever the backend.
+    """
+    return {
+        "generated_tokens": generated_tokens,
+        "tokens_per_second": round(generated_tokens / seconds, 1) if seconds > 0 else None,
+        "hit_max_tokens": generated_tokens >= max_tokens,
+        "repetition": repetition_ratio(text),
+    }
+
+
+def _length_buckets(lengths, batch_size: int):
+    """
+    Groups prompt indices into batches of similar length (sorted, then cut every batch_size),
+    so short prompts aren't padded up to the longest one in the whole list.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+# --- MLX (Apple Silicon, the default) ---
+
+class MLXTextBackend:
+    """
+    Optional speculative decoding: with a draft_model (same tokenizer, e.g. Llama-3.2-1B),
+    generate() for the adapters in draft_styles lets the draft propose num_draft_tokens
+    tokens that the main model verifies in one pass. Greedy verification keeps the output
+    the same as plain decoding, only faster when the draft guesses well.
+    """
+    def __init__(self, base_model: str, adapters: dict, draft_model: str = None, draft_styles=(),
+                 num_draft_tokens: int = 2):
+        self.base_model = base_model
+        self.adapters = adapters
+        self.manager = None  # ModelManager, created on first use (it imports mlx)
+        self.cache_id = "mlx"
+        self.active_adapter = None
+        self.draft_model_id = draft_model
+        self.draft_styles = set(draft_styles or ())
+        self.num_draft_tokens = num_draft_tokens
+        self._draft = None
+        self._prefix_caches = {}  # (adapter, prefix text, drafted) -> (prefix token ids, prefilled prompt cache)
+        self.resident_models = [("text", base_model)] + ([("draft", draft_model)] if draft_model else [])
+        self._check_draft_fits()
+
+    def _check_draft_fits(self) -> bool:
+        """
+        Speculative decoding needs the draft and the main model resident together. When they
+        don't fit the budget, loading one would evict the other on every section, so the draft is dropped.
+        """
+        if not self.draft_model_id or RESIDENCY.fits(self.resident_models):
+            return True
+        needed = sum(RESIDENCY.footprint(name, model_id) for name, model_id in self.resident_models)
+        print(f"⚠️ {self.base_model} + draft {self.draft_model_id} need ~{needed / GB:.1f} GB, "
+              f"budget {RESIDENCY.budget / GB:.1f} GB: speculative decoding is off")
+        self.draft_model_id = None
+        self.resident_models = [("text", self.base_model)]
+        return False
+
+    def use_adapter(self, name: str = None):
+        # The actual swap happens on the first generate(), so fully cached work never loads anything
+        self.active_adapter = name
+
+    def _model(self):
+        if self.manager is None:
+            # Imported here so the rest of the pipeline (and render, which never loads a model) runs without MLX
+            from utils.model_manager import ModelManager
+            self.manager = ModelManager(self.base_model, self.adapters)
+        if self.manager.model is None:
+            return RESIDENCY.load(
+                "text", self.base_model, lambda: self.manager.use_adapter(self.active_adapter), self.unload,
+                measure=mlx_active_memory,
+            )
+        RESIDENCY.touch("text")
+        return self.manager.use_adapter(self.active_adapter)
+
+    def count_tokens(self, text: str) -> int:
+        _, tokenizer = self._model()
+        return len(tokenizer.encode(text))
+
+    def _draft_model(self):
+        """
+        The draft model for the active adapter, or None. The draft has no LoRA, so styles whose
+        adapter drifts far from the base model accept fewer tokens; hence the per-style switch.
+        """
+        if not self.draft_model_id:
+            return None
+        if "all" not in self.draft_styles and (self.active_adapter or "base") not in self.draft_styles:
+            return None
+        if self._draft is None:
+            # The measured footprints of the first load can be larger than the estimate
+            if not self._check_draft_fits():
+                return None
+            from mlx_lm import load
+
+            def load_draft():
+                print(f"Loading draft model {self.draft_model_id}...")
+                with TRACER.span("load_model", model=self.draft_model_id, kind="draft"):
+                    return load(self.draft_model_id)[0]
+
+            self._draft = RESIDENCY.load("draft", self.draft_model_id, load_draft, self._unload_draft, measure=mlx_active_memory)
+        RESIDENCY.touch("draft")
+        return self._draft
+
+    def _unload_draft(self):
+        # Prompt caches built with the draft hold its layer caches too
+        self._prefix_caches = {key: value for key, value in self._prefix_caches.items() if not key[2]}
+        self._draft = None
+        RESIDENCY.release("draft")
+
+    def _build_prefix_cache(self, model, tokenizer, prefix: str, prompt: list, draft=None):
+        import mlx.core as mx
+        from mlx_lm.models.cache import make_prompt_cache
+
+        # Token ids shared by the templated prefix and the real prompt: chat header + instruction.
+        # Comparing tokens (not text) keeps us safe from merges at the prefix/content boundary.
+        prefix_ids = tokenizer.apply_chat_template([{"role": "user", "content": prefix}], add_generation_prompt=True)
+        n = 0
+        limit = min(len(prefix_ids), len(prompt) - 1)  # at least one token must be left to generate from
+        while n < limit and prefix_ids[n] == prompt[n]:
+            n += 1
+
+        # Speculative decoding expects the main model's layer caches followed by the draft's
+        prompt_cache = make_prompt_cache(model)
+        draft_cache = make_prompt_cache(draft) if draft is not None else []
+        if n:
+            tokens = mx.array(prompt[:n])[None]
+            model(tokens, cache=prompt_cache)
+            if draft is not None:
+                draft(tokens, cache=draft_cache)
+            mx.eval([c.state for c in prompt_cache + draft_cache])
+        return list(prompt[:n]), prompt_cache + draft_cache
+
+    def _cached_prefix(self, model, tokenizer, prefix: str, prompt: list, draft=None):
+        """
+        Returns (prefix length, a private copy of its prefilled prompt cache), or (0, None).
+        The prefix is prefilled once per adapter; every call after that only prefills the rest.
+        """
+        key = (self.active_adapter, prefix, draft is not None)
+        entry = self._prefix_caches.get(key)
+        if entry is None or prompt[:len(entry[0])] != entry[0]:
+            # First use, or the chat template changed underneath us (e.g. a date in the system header)
+            entry = self._build_prefix_cache(model, tokenizer, prefix, prompt, draft)
+            self._prefix_caches[key] = entry
+        prefix_ids, prompt_cache = entry
+        if not prefix_ids:
+            return 0, None
+        return len(prefix_ids), copy.deepcopy(prompt_cache)
+
+    def generate(self, prompt_text: str, max_tokens: int = 1000, response_schema: dict = None,
+                 prefix: str = None, **params) -> str:
+        # mlx_lm has no constrained decoding, so response_schema is left to the prompt.
+        # stream_generate is what mlx_lm.generate uses inside; streaming gives us time to first token
+        from mlx_lm import stream_generate
+        model, tokenizer = self._model()
+        messages = [{"role": "user", "content": prompt_text}]
+        prompt = tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+
+        draft = self._draft_model()
+        if draft is not None:
+            params = dict(params, draft_model=draft, num_draft_tokens=self.num_draft_tokens)
+
+        cached = 0
+        if prefix and prompt_text.startswith(prefix):
+            cached, prompt_cache = self._cached_prefix(model, tokenizer, prefix, prompt, draft)
+            if cached:
+                prompt = prompt[cached:]
+                params = dict(params, prompt_cache=prompt_cache)
+
+        with TRACER.span("generate", backend="mlx", adapter=self.active_adapter, max_tokens=max_tokens,
+                         cached_prefix_tokens=cached, speculative=draft is not None) as span:
+            start = time.perf_counter()
+            pieces, ttft, last, accepted = [], None, None, 0
+            for response in stream_generate(model, tokenizer, prompt, max_tokens=max_tokens, **params):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                pieces.append(response.text)
+                accepted += response.from_draft
+                last = response
+            text = "".join(pieces)
+
+            if draft is not None and last is not None:
+                span.set(
+                    draft_tokens_accepted=accepted,
+                    acceptance_rate=round(accepted / last.generation_tokens, 3) if last.generation_tokens else None,
+                )
+
+            if last is not None:
+                span.set(
+                    prompt_tokens=last.prompt_tokens,
+                    prompt_tokens_per_second=round(last.prompt_tps, 1),
+                    ttft_ms=round(ttft * 1000, 1),
+                    peak_memory_gb=round(last.peak_memory, 2),
+                    **_generation_stats(text, last.generation_tokens, max_tokens, time.perf_counter() - start - ttft),
+                )
+        return text
+
+    def generate_batch(self, prompt_texts, max_tokens: int = 1000, batch_size: int = 4, prefix: str = None,
+                       **params):
+        """
+        Decodes up to batch_size sequences at once with mlx_lm.batch_generate (greedy, like
+        generate). Each sequence stops on its own at <|eot_id|>. The prefix cache and the draft
+        model aren't used here: batch_generate prefills the whole batch together and has
+        no speculative mode.
+        """
+        from mlx_lm import batch_generate
+        model, tokenizer = self._model()
+        prompts = [
+            tokenizer.apply_chat_template([{"role": "user", "content": text}], add_generation_prompt=True)
+            for text in prompt_texts
+        ]
+
+        outputs = [None] * len(prompts)
+        for bucket in _length_buckets([len(p) for p in prompts], batch_size):
+            with TRACER.span("batched_generate", backend="mlx", adapter=self.active_adapter,
+                             batch=len(bucket), max_tokens=max_tokens) as span:
+                result = batch_generate(
+                    model, tokenizer, [prompts[i] for i in bucket], max_tokens=max_tokens,
+                    completion_batch_size=len(bucket), prefill_batch_size=len(bucket),
+                )
+                stats = result.stats
+                at_max = sum(1 for text in result.texts if len(tokenizer.encode(text)) >= max_tokens)
+                span.set(
+                    prompt_tokens=stats.prompt_tokens,
+                    prompt_tokens_per_second=round(stats.prompt_tps, 1),
+                    generated_tokens=stats.generation_tokens,
+                    tokens_per_second=round(stats.generation_tps, 1),
+                    peak_memory_gb=round(stats.peak_memory, 2),
+                    hit_max_tokens=at_max > 0,
+                    sequences_at_max_tokens=at_max,
+                    repetition=max(repetition_ratio(text) for text in result.texts),
+                )
+            for i, text in zip(bucket, result.texts):
+                outputs[i] = text
+        return outputs
+
+    def unload(self):
+        self._prefix_caches = {}
+        self._draft = None
+        if self.manager is not None:
+            self.manager.unload()
+        RESIDENCY.release("text")
+        RESIDENCY.release("draft")
+
+
+class MLXVisionBackend:
+    """
+    Loads the VLM on first use, so papers whose captions are all cached never pay for it.
+    """
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.cache_id = f"mlx:{model_id}"
+        self._loaded = None
+        self.resident_models = [("vision", model_id)]
+
+    def _load(self):
+        if self._loaded is None:
+            from mlx_vlm import load
+            from mlx_vlm.utils import load_config
+
+            def load_vision():
+                print("Waking up Vision Model...")
+                with TRACER.span("load_model", model=self.model_id, kind="vision"):
+                    model, processor = load(self.model_id)
+                    return model, processor, load_config(self.model_id)
+
+            self._loaded = RESIDENCY.load("vision", self.model_id, load_vision, self.unload, measure=mlx_active_memory)
+        RESIDENCY.touch("vision")
+        return self._loaded
+
+    def caption(self, image_path: str, prompt: str, **params) -> str:
+        from mlx_vlm import generate
+        from mlx_vlm.prompt_utils import apply_chat_template
+        model, processor, config = self._load()
+
+        formatted_prompt = apply_chat_template(processor, config, prompt, num_images=1)
+        output = generate(model, processor, formatted_prompt, [image_path], verbose=False, **params)
+
+        # Extract text from GenerationResult object
+        return output.text
+
+    def unload(self):
+        self._loaded = None
+        RESIDENCY.release("vision")
+
+
+# --- OpenAI-compatible local server (mlx_lm.server, llama.cpp, vLLM, ...) ---
+
+def _post_json(url: str, body: dict, api_key: str = None, timeout: float = 600) -> dict:
+    import urllib.request
+
+    request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"), method="POST")
+    request.add_header("Content-Type", "application/json")
+    if api_key:
+        request.add_header("Authorization", f"Bearer {api_key}")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def _chat_body(model: str, content, max_tokens: int, params: dict, response_schema: dict = None) -> dict:
+    body = {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": max_tokens,
+        "temperature": params.get("temp", 0.0),  # mlx_lm defaults to greedy
+    }
+    if "repeat_penalty" in params:
+        body["repetition_penalty"] = params["repeat_penalty"]
+    if response_schema is not None:
+        # Structured outputs (vLLM, llama.cpp); servers without it just ignore the field
+        body["response_format"] = {"type": "json_schema", "json_schema": {"name": "response", "schema": response_schema}}
+    return body
+
+
+class OpenAITextBackend:
+    """
+    Talks to /v1/chat/completions. Each adapter is expected to be served under its own
+    model name (e.g. vLLM --lora-modules eli5=adapters/eli5_final), falling back to the
+    adapter name itself; no adapter means base_model. Servers that do continuous
+    batching can take several of these requests at once.
+    """
+    def __init__(self, base_url: str, base_model: str, models: dict = None, api_key: str = None):
+        self.base_url = base_url.rstrip("/")
+        self.base_model = base_model
+        self.models = models or {}
+        self.api_key = api_key
+        self.cache_id = f"openai:{self.base_url}:{json.dumps(self.models, sort_keys=True)}"
+        self.active_adapter = None
+
+    def use_adapter(self, name: str = None):
+        self.active_adapter = name
+
+    def count_tokens(self, text: str) -> int:
+        # No tokenizer on this side; ~4 characters per token is close enough for chunking
+        return max(1, len(text) // 4)
+
+    def generate(self, prompt_text: str, max_tokens: int = 1000, response_schema: dict = None,
+                 prefix: str = None, **params) -> str:
+        # prefix is ignored: servers with prefix caching (vLLM, llama.cpp) find shared prefixes themselves
+        model = self.base_model if self.active_adapter is None else self.models.get(self.active_adapter, self.active_adapter)
+        with TRACER.span("generate", backend="openai", adapter=self.active_adapter, max_tokens=max_tokens) as span:
+            start = time.perf_counter()
+            data = _post_json(
+                f"{self.base_url}/chat/completions",
+                _chat_body(model, prompt_text, max_tokens, params, response_schema), self.api_key
+            )
+            text = data["choices"][0]["message"]["content"]
+            # No streaming here, so no time to first token; usage is optional in the API
+            usage = data.get("usage") or {}
+            span.set(
+                prompt_tokens=usage.get("prompt_tokens"),
+                **_generation_stats(
+                    text, usage.get("completion_tokens", self.count_tokens(text)), max_tokens, time.perf_counter() - start
+                ),
+            )
+        return text
+
+    def generate_batch(self, prompt_texts, max_tokens: int = 1000, batch_size: int = 4, prefix: str = None,
+                       **params):
+        # Concurrent requests; a server with continuous batching decodes them together
+        with ThreadPoolExecutor(max_workers=batch_size) as pool:
+            return list(pool.map(lambda text: self.generate(text, max_tokens, **params), prompt_texts))
+
+    def unload(self):
+        pass
+
+
+class OpenAIVisionBackend:
+    def __init__(self, base_url: str, model: str, api_key: str = None):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key
+        self.cache_id = f"openai:{self.base_url}:{model}"
+
+    def caption(self, image_path: str, prompt: str, max_tokens: int = 500, **params) -> str:
+        mime = mimetypes.guess_type(image_path)[0] or "image/png"
+        with open(image_path, "rb") as f:
+            image_url = f"data:{mime};base64,{base64.b64encode(f.read()).decode('ascii')}"
+        content = [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": image_url}},
+        ]
+        data = _post_json(
+            f"{self.base_url}/chat/completions", _chat_body(self.model, content, max_tokens, params), self.api_key
+        )
+        return data["choices"][0]["message"]["content"]
+
+    def unload(self):
+        pass
+
+
+# --- Deterministic stub (any OS, for timing the pipeline itself) ---
+
+STUB_WORDS = (
+    "the model layer attention data memory cost latency tokens cache kernel graph "
+    "gradient loss batch signal result method paper section idea simple because "
+    "like a postman sorting mail each step reuses what came before so it is fast"
+).split()
+
+
+def _stub_text(seed: str, n_tokens: int, tag: str) -> str:
+    rng = random.Random(hashlib.sha256(seed.encode("utf-8")).hexdigest())
+    words = [rng.choice(STUB_WORDS) for _ in range(max(0, n_tokens - 1))]
+    # A line break every ~25 words so callout formatting gets exercised
+    for i in range(25, len(words), 25):
+        words[i] = words[i] + "\n"
+    return " ".join([f"[{tag}]"] + words).replace("\n ", "\n")
+
+
+def _stub_object(schema: dict, seed: str, n_tokens: int):
+    """
+    A value matching a (simple) JSON schema, with every string filled with stub text.
+    """
+    if schema.get("type") == "object":
+        properties = schema.get("properties", {})
+        share = max(1, n_tokens // max(1, len(properties)))
+        return {name: _stub_object(sub, f"{seed}|{name}", share) for name, sub in properties.items()}
+    return _stub_text(seed, n_tokens, seed.rsplit("|", 1)[-1])
+
+
+class StubTextBackend:
+    """
+    Same prompt -> same text, produced at tokens_per_second (0 = instantly), with prefill
+    charged at prefill_tokens_per_second. Makes pipeline timings reproducible on any box.
+    """
+    def __init__(self, tokens_per_second: float = 0.0, prefill_tokens_per_second: float = 0.0,
+                 output_tokens: int = 120, load_seconds: float = 0.0):
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.output_tokens = output_tokens
+        self.load_seconds = load_seconds
+        self.cache_id = f"stub:{output_tokens}"
+        self.active_adapter = None
+        self._loaded = False
+        self._seen_prefixes = set()
+        # Stands in for the default models: same footprints, so memory planning behaves the same
+        self.resident_models = [("text", "stub:text")]
+
+    def use_adapter(self, name: str = None):
+        self.active_adapter = name
+
+    def count_tokens(self, text: str) -> int:
+        return max(1, len(text) // 4)
+
+    def generate(self, prompt_text: str, max_tokens: int = 1000, response_schema: dict = None,
+                 prefix: str = None, **params) -> str:
+        if not self._loaded:
+            RESIDENCY.load("text", "stub:text", self._load, self.unload)
+        RESIDENCY.touch("text")
+
+        with TRACER.span("generate", backend="stub", adapter=self.active_adapter, max_tokens=max_tokens) as span:
+            start = time.perf_counter()
+            n_tokens = min(max_tokens, self.output_tokens)
+            prompt_tokens = self.count_tokens(prompt_text)
+            # Charged like the MLX prefix cache: a prefix seen before with this adapter is free
+            cached = 0
+            if prefix and prompt_text.startswith(prefix):
+                if (self.active_adapter, prefix) in self._seen_prefixes:
+                    cached = min(self.count_tokens(prefix), prompt_tokens - 1)
+                self._seen_prefixes.add((self.active_adapter, prefix))
+            prefill_tokens = prompt_tokens - cached
+            prefill = prefill_tokens / self.prefill_tokens_per_second if self.prefill_tokens_per_second > 0 else 0.0
+            decode = n_tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+            time.sleep(prefill + decode)
+            seed = f"{self.active_adapter}|{prompt_text}"
+            if response_schema is not None:
+                text = json.dumps(_stub_object(response_schema, seed, n_tokens))
+            else:
+                text = _stub_text(seed, n_tokens, self.active_adapter or "base")
+            span.set(
+                prompt_tokens=prefill_tokens,
+                cached_prefix_tokens=cached,
+                ttft_ms=round(prefill * 1000, 1),
+                **_generation_stats(text, n_tokens, max_tokens, time.perf_counter() - start - prefill),
+            )
+        return text
+
+    def _load(self):
+        with TRACER.span("load_model", model="stub", kind="text"):
+            time.sleep(self.load_seconds)
+        self._loaded = True
+
+    def generate_batch(self, prompt_texts, max_tokens: int = 1000, batch_size: int = 4, prefix: str = None,
+                       **params):
+        """
+        Same texts as generate(). Prefill is charged per prompt, decode once per batch:
+        the sequences of a batch are decoded side by side.
+        """
+        outputs = [None] * len(prompt_texts)
+        n_tokens = min(max_tokens, self.output_tokens)
+        for bucket in _length_buckets([len(t) for t in prompt_texts], batch_size):
+            with TRACER.span("batched_generate", backend="stub", adapter=self.active_adapter,
+                             batch=len(bucket), max_tokens=max_tokens) as span:
+                prompt_tokens = sum(self.count_tokens(prompt_texts[i]) for i in bucket)
+                delay = 0.0
+                if self.prefill_tokens_per_second > 0:
+                    delay += prompt_tokens / self.prefill_tokens_per_second
+                if self.tokens_per_second > 0:
+                    delay += n_tokens / self.tokens_per_second
+                time.sleep(delay)
+                for i in bucket:
+                    seed = f"{self.active_adapter}|{prompt_texts[i]}"
+                    outputs[i] = _stub_text(seed, n_tokens, self.active_adapter or "base")
+                span.set(prompt_tokens=prompt_tokens, generated_tokens=n_tokens * len(bucket))
+        return outputs
+
+    def unload(self):
+        self._loaded = False
+        self._seen_prefixes = set()
+        RESIDENCY.release("text")
+
+
+class StubVisionBackend:
+    def __init__(self, seconds_per_image: float = 0.0, output_tokens: int = 40):
+        self.seconds_per_image = seconds_per_image
+        self.output_tokens = output_tokens
+        self.cache_id = f"stub:{output_tokens}"
+        self._loaded = False
+        self.resident_models = [("vision", "stub:vision")]
+
+    def caption(self, image_path: str, prompt: str, max_tokens: int = 500, **params) -> str:
+        if not self._loaded:
+            RESIDENCY.load("vision", "stub:vision", self._load, self.unload)
+        RESIDENCY.touch("vision")
+        with open(image_path, "rb") as f:
+            seed = hashlib.sha256(f.read()).hexdigest()
+        time.sleep(self.seconds_per_image)
+        return _stub_text(seed + prompt, min(max_tokens, self.output_tokens), "vision").replace("\n", "")
+
+    def _load(self):
+        with TRACER.span("load_model", model="stub", kind="vision"):
+            self._loaded = True
+
+    def unload(self):
+        self._loaded = False
+        RESIDENCY.release("vision")
+
+
+def make_backends(kind: str, base_model: str, adapters: dict, vision_model: str, draft_model: str = None,
+                  draft_styles=(), num_draft_tokens: int = 2):
+    """
+    Returns (text_backend, vision_backend) for "mlx", "openai" or "stub".
+
+    draft_model / draft_styles turn on speculative decoding for those styles (mlx only;
+    an OpenAI-compatible server configures its own draft model).
+
+    openai reads PAPER_OPENAI_URL (default http://localhost:8080/v1), PAPER_OPENAI_KEY,
+    PAPER_OPENAI_MODEL / PAPER_OPENAI_VISION_MODEL and PAPER_OPENAI_ADAPTER_MODELS
+    (JSON, e.g. {"eli5": "llama-eli5"}). stub reads PAPER_STUB_TPS, PAPER_STUB_PREFILL_TPS
+    and PAPER_STUB_IMAGE_SECONDS.
+    """
+    if kind == "mlx":
+        text = MLXTextBackend(base_model, adapters, draft_model, draft_styles, num_draft_tokens)
+        return text, MLXVisionBackend(vision_model)
+
+    if kind == "openai":
+        url = os.environ.get("PAPER_OPENAI_URL", "http://localhost:8080/v1")
+        api_key = os.environ.get("PAPER_OPENAI_KEY")
+        models = json.loads(os.environ.get("PAPER_OPENAI_ADAPTER_MODELS", "{}"))
+        text = OpenAITextBackend(url, os.environ.get("PAPER_OPENAI_MODEL", base_model), models, api_key)
+        vision = OpenAIVisionBackend(url, os.environ.get("PAPER_OPENAI_VISION_MODEL", vision_model), api_key)
+        return text, vision
+
+    if kind == "stub":
+        text = StubTextBackend(
+            tokens_per_second=float(os.environ.get("PAPER_STUB_TPS", "0")),
+            prefill_tokens_per_second=float(os.environ.get("PAPER_STUB_PREFILL_TPS", "0")),
+        )
+        vision = StubVisionBackend(seconds_per_image=float(os.environ.get("PAPER_STUB_IMAGE_SECONDS", "0")))
+        return text, vision
+
+    raise ValueError(f"Unknown backend '{kind}', expected one of {BACKENDS}")
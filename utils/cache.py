@@ -0,0 +1,193 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+# Everything lives under one root so it can be inspected / pruned in one place
+CACHE_ROOT = os.environ.get(
+    "PAPER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "paper-to-obsidian")
+)
+DEFAULT_MAX_MB = int(os.environ.get("PAPER_CACHE_MAX_MB", "512"))
+
+_file_hashes = {}
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    """
+    sha256 of a file's bytes, memoized on (path, size, mtime) so big files are only read once.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        _file_hashes[memo_key] = h.hexdigest()
+    return _file_hashes[memo_key]
+
+
+class DiskCache:
+    """
+    Content-addressed JSON cache on disk with size-bounded LRU eviction.
+
+    One file per entry (sharded by the first 2 hex chars of the key). The file mtime
+    doubles as the "last used" timestamp, so a hit just touches the file.
+    """
+
+    def __init__(self, name: str, root: str = CACHE_ROOT, max_mb: int = DEFAULT_MAX_MB):
+        self.name = name
+        self.cache_dir = os.path.join(root, name)
+        self.max_bytes = max_mb * 1024 * 1024
+        self._total_bytes = None  # computed lazily on first put
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        return hash_text(json.dumps(parts, sort_keys=True))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            os.utime(path)  # mark as recently used
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["value"]
+
+    def put(self, key: str, value, meta: dict = None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        data = json.dumps({"value": value, "meta": meta or {}, "created": time.time()})
+
+        # Write + rename so a crash never leaves a half-written entry behind
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self.entries())
+        else:
+            self._total_bytes += len(data.encode("utf-8")) - old_size
+
+        if self._total_bytes > self.max_bytes:
+            # Evict down to 90% so we don't rescan on every single put
+            self.prune(int(self.max_bytes * 0.9))
+
+    def entries(self):
+        """
+        Returns [(path, size, last_used)] for every entry.
+        """
+        result = []
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for shard in os.listdir(self.cache_dir):
+            shard_dir = os.path.join(self.cache_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for file_name in os.listdir(shard_dir):
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(shard_dir, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                result.append((path, stat.st_size, stat.st_mtime))
+        return result
+
+    def prune(self, max_bytes: int = None, older_than_days: float = None) -> int:
+        """
+        Deletes least-recently-used entries until the cache fits in max_bytes,
+        plus anything unused for older_than_days. Returns the number of entries removed.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = sorted(self.entries(), key=lambda e: e[2])  # oldest first
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - older_than_days * 86400 if older_than_days is not None else None
+
+        removed = 0
+        for path, size, last_used in entries:
+            if total <= max_bytes and (cutoff is None or last_used >= cutoff):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+
+        self._total_bytes = total
+        return removed
+
+    def clear(self) -> int:
+        return self.prune(max_bytes=0)
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        return {
+            "name": self.name,
+            "path": self.cache_dir,
+            "entries": len(entries),
+            "size_mb": round(sum(size for _, size, _ in entries) / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "oldest_use": min((e[2] for e in entries), default=None),
+            "newest_use": max((e[2] for e in entries), default=None),
+        }
+
+
+def list_caches(root: str = CACHE_ROOT):
+    if not os.path.isdir(root):
+        return []
+    return sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and prune the paper-to-obsidian caches")
+    parser.add_argument("--root", default=CACHE_ROOT, help="Cache root directory")
+    parser.add_argument("--name", help="Only act on this cache (e.g. generations)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("info", help="Show size and entry counts")
+    prune = sub.add_parser("prune", help="Evict least-recently-used entries")
+    prune.add_argument("--max-mb", type=float, default=DEFAULT_MAX_MB, help="Target size per cache")
+    prune.add_argument("--older-than-days", type=float, help="Also drop entries unused for this long")
+    sub.add_parser("clear", help="Delete every entry")
+
+    args = parser.parse_args(argv)
+    names = [args.name] if args.name else list_caches(args.root)
+    if not names:
+        print(f"No caches under {args.root}")
+        return
+
+    for name in names:
+        cache = DiskCache(name, root=args.root)
+        if args.command == "info":
+            stats = cache.stats()
+            print(f"{stats['name']:<14} {stats['entries']:>7} entries  {stats['size_mb']:>9} MB  ({stats['path']})")
+        elif args.command == "prune":
+            removed = cache.prune(int(args.max_mb * 1024 * 1024), args.older_than_days)
+            print(f"{name}: removed {removed} entries")
+        elif args.command == "clear":
+            print(f"{name}: removed {cache.clear()} entries")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import re
+from typing import Callable, List
+
+# Lines that start a subsection inside a top-level section (5.1, **Setup**, ### ...)
+SUBSECTION_PATTERN = re.compile(r'^(#+\s|\*\*|\d+\.\d+)')
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+
+def _pack(pieces: List[str], sizes: List[int], max_tokens: int, sep: str = "\n") -> List[str]:
+    """
+    Greedily packs consecutive pieces into chunks of at most max_tokens (+1 token per separator).
+    """
+    chunks = []
+    current, current_size = [], 0
+    for piece, size in zip(pieces, sizes):
+        if current and current_size + size + 1 > max_tokens:
+            chunks.append(sep.join(current))
+            current, current_size = [], 0
+        current.append(piece)
+        current_size += size + (1 if len(current) > 1 else 0)
+    if current:
+        chunks.append(sep.join(current))
+    return chunks
+
+
+def _split_oversized(text: str, count_tokens: Callable[[str], int], max_tokens: int) -> List[str]:
+    """
+    Last resort for a single paragraph that doesn't fit: split at sentences,
+    and hard-split any sentence that is still too long.
+    """
+    pieces = []
+    for sentence in SENTENCE_PATTERN.split(text):
+        size = count_tokens(sentence)
+        if size <= max_tokens:
+            pieces.append(sentence)
+            continue
+        # No natural boundary left: cut by characters proportional to the token count
+        step = max(1, len(sentence) * max_tokens // size)
+        pieces.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+    return _pack(pieces, [count_tokens(p) for p in pieces], max_tokens, sep=" ")
+
+
+def split_into_chunks(text: str, count_tokens: Callable[[str], int], max_tokens: int) -> List[str]:
+    """
+    Splits a section into chunks of at most max_tokens, measured with the real tokenizer.
+    Prefers subsection boundaries, then paragraph (line) boundaries, then sentences.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    # 1. Group lines into subsections
+    subsections = []
+    for line in text.split("\n"):
+        if not subsections or SUBSECTION_PATTERN.match(line.strip()):
+            subsections.append([line])
+        else:
+            subsections[-1].append(line)
+
+    chunks, chunk_sizes = [], []
+    for lines in subsections:
+        block = "\n".join(lines)
+        block_size = count_tokens(block)
+
+        # 2. Whole subsection fits: try to add it to the previous chunk
+        if block_size <= max_tokens:
+            if chunks and chunk_sizes[-1] + block_size + 1 <= max_tokens:
+                chunks[-1] = chunks[-1] + "\n" + block
+                chunk_sizes[-1] += block_size + 1
+            else:
+                chunks.append(block)
+                chunk_sizes.append(block_size)
+            continue
+
+        # 3. Too big: pack its paragraphs, splitting any paragraph that is too big on its own
+        paragraphs = []
+        for line in lines:
+            if count_tokens(line) <= max_tokens:
+                paragraphs.append(line)
+            else:
+                paragraphs.extend(_split_oversized(line, count_tokens, max_tokens))
+        for chunk in _pack(paragraphs, [count_tokens(p) for p in paragraphs], max_tokens):
+            chunks.append(chunk)
+            chunk_sizes.append(count_tokens(chunk))
+
+    return chunks
+
+
+def truncate_tokens(text: str, count_tokens: Callable[[str], int], max_tokens: int) -> str:
+    """
+    text cut at a sentence (or, failing that, a character) boundary to at most max_tokens.
+    """
+    size = count_tokens(text)
+    if size <= max_tokens:
+        return text
+    kept = []
+    for sentence in SENTENCE_PATTERN.split(text):
+        if count_tokens(" ".join(kept + [sentence])) > max_tokens:
+            break
+        kept.append(sentence)
+    if kept:
+        return " ".join(kept)
+    return text[:max(1, len(text) * max_tokens // size)]
+
+
+def reduce_groups(partials: List[str], count_tokens: Callable[[str], int], max_tokens: int) -> List[str]:
+    """
+    One round of the tree reduce: the merged inputs of the next reduce calls,
+    grouped so each fits in max_tokens.
+    """
+    # A reduce call must never get more than max_tokens, not even for one partial on its own
+    partials = [truncate_tokens(p, count_tokens, max_tokens) for p in partials]
+    groups = _pack(partials, [count_tokens(p) for p in partials], max_tokens, sep="\n\n")
+    if len(groups) == len(partials):
+        # Every partial is too big to pair up: merge two at a time anyway so we always make
+        # progress, cut down to half the budget each so the pair still fits
+        half = (max_tokens - 1) // 2
+        partials = [truncate_tokens(p, count_tokens, half) for p in partials]
+        groups = ["\n\n".join(partials[i:i + 2]) for i in range(0, len(partials), 2)]
+    return groups
+
+
+def reduce_partials(partials: List[str], reduce_fn: Callable[[str, bool], str],
+                    count_tokens: Callable[[str], int], max_tokens: int) -> str:
+    """
+    Merges per-chunk answers into one. Partials are grouped so each reduce call fits
+    in max_tokens; if that still leaves several results, they are reduced again (tree reduce).
+    reduce_fn(merged, final) is told whether its answer is the final one or input to another round.
+    """
+    while len(partials) > 1:
+        groups = reduce_groups(partials, count_tokens, max_tokens)
+        partials = [reduce_fn(group, len(groups) == 1) for group in groups]
+    return partials[0]
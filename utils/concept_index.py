@@ -0,0 +1,314 @@
+import json
+import os
+import re
+import time
+from utils.cache import CACHE_ROOT, hash_text
+
+INDEX_DIR = os.path.join(CACHE_ROOT, "concept-index")
+INDEX_VERSION = 1
+# Vault folders that aren't notes (assets/ holds the PDFs and images of this pipeline)
+SKIP_DIRS = {"assets", "inbox"}
+# In daemon mode, look for new / edited notes at most this often
+REFRESH_INTERVAL = 30.0
+CONCEPT_INDEX = os.environ.get("PAPER_CONCEPT_INDEX", "1") != "0"
+
+# Headings (and notes) like these appear everywhere and mean nothing on their own
+GENERIC_TERMS = {
+    "abstract", "introduction", "conclusion", "conclusions", "related work", "background", "method",
+    "methods", "methodology", "results", "discussion", "experiments", "evaluation", "references",
+    "appendix", "acknowledgements", "acknowledgments", "summary", "overview", "notes", "todo",
+    "ideas", "example", "examples", "definition", "model", "models", "data", "paper", "system",
+    "analysis", "approach", "problem", "learning", "setup", "limitations", "future work",
+}
+
+WORD_PATTERN = re.compile(r"\w+")
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+HEADING_NUMBER_PATTERN = re.compile(r"^(\d+(\.\d+)*\.?|[IVX]+\.)\s+")
+# Text that must not get links: existing links, code, inline math
+PROTECTED_PATTERN = re.compile(r"\[\[.*?\]\]|`[^`]*`|\$[^$\n]*\$")
+LINK_PATTERN = re.compile(r"\[\[([^\]|#]+)\]\]")
+
+
+def index_path(vault_path: str) -> str:
+    return os.path.join(INDEX_DIR, f"{hash_text(os.path.abspath(vault_path))[:16]}.json")
+
+
+def read_note_terms(path: str) -> dict:
+    """
+    Title, frontmatter aliases and headings of one note.
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        text = f.read()
+
+    aliases = []
+    if text.startswith("---\n"):
+        end = text.find("\n---", 4)
+        frontmatter = text[4:end] if end > 0 else ""
+        text = text[end + 4:] if end > 0 else text
+        lines = frontmatter.split("\n")
+        for i, line in enumerate(lines):
+            key, _, value = line.partition(":")
+            if key.strip() not in ("aliases", "alias"):
+                continue
+            value = value.strip()
+            if value.startswith("["):
+                aliases += [a.strip().strip("\"'") for a in value.strip("[]").split(",")]
+            elif value:
+                aliases.append(value.strip("\"'"))
+            else:
+                for item in lines[i + 1:]:
+                    if not item.strip().startswith("- "):
+                        break
+                    aliases.append(item.strip()[2:].strip().strip("\"'"))
+
+    headings = [HEADING_NUMBER_PATTERN.sub("", h).strip().rstrip(":") for h in HEADING_PATTERN.findall(text)]
+    return {"aliases": [a for a in aliases if a], "headings": [h for h in headings if h]}
+
+
+class ConceptIndex:
+    """
+    Titles, aliases and headings of every note in the vault, kept on disk and refreshed
+    by file mtime, so only new or edited notes are ever re-read.
+
+    Matching runs a word-level Aho-Corasick automaton over the text: one pass, linear in
+    the text length however many notes there are, and terms only match whole words.
+    """
+
+    def __init__(self, vault_path: str):
+        self.vault_path = os.path.abspath(vault_path)
+        self.path = index_path(vault_path)
+        self.notes = {}  # rel_path -> {"mtime_ns", "size", "aliases", "headings", "paper"}
+        self._automaton = None
+        self._refreshed = 0.0
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self.notes = data["notes"]
+        except (OSError, ValueError):
+            pass
+
+    def _walk(self):
+        stack = [self.vault_path]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if directory != self.vault_path or entry.name not in SKIP_DIRS:
+                        stack.append(entry.path)
+                elif entry.name.endswith(".md"):
+                    yield entry
+
+    def refresh(self) -> int:
+        """
+        Re-reads notes whose mtime or size changed and drops deleted ones. Returns how many changed.
+        """
+        seen = set()
+        changed = 0
+        for entry in self._walk():
+            rel_path = os.path.relpath(entry.path, self.vault_path)
+            seen.add(rel_path)
+            stat = entry.stat()
+            known = self.notes.get(rel_path)
+            if known and known["mtime_ns"] == stat.st_mtime_ns and known["size"] == stat.st_size:
+                continue
+            try:
+                terms = read_note_terms(entry.path)
+            except OSError:
+                continue
+            stem = os.path.splitext(entry.name)[0]
+            # Notes written by this pipeline: their section headings are paper sections, not concepts
+            terms["paper"] = os.path.isdir(os.path.join(self.vault_path, "assets", stem))
+            self.notes[rel_path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, **terms}
+            changed += 1
+
+        for rel_path in set(self.notes) - seen:
+            del self.notes[rel_path]
+            changed += 1
+
+        if changed or self._automaton is None:
+            self._automaton = None
+            self._save()
+        self._refreshed = time.monotonic()
+        return changed
+
+    def _save(self):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": INDEX_VERSION, "vault": self.vault_path, "notes": self.notes}, f)
+        os.replace(tmp_path, self.path)
+
+    def _terms(self):
+        """
+        (term, target, rank) for every indexed name. Lower rank wins when two notes share a term.
+        Headings of non-paper notes come last; see _build for how little of them is matched.
+        """
+        for rel_path, note in sorted(self.notes.items()):
+            title = os.path.splitext(os.path.basename(rel_path))[0]
+            yield title, title, 0
+            for alias in note["aliases"]:
+                yield alias, title, 1
+            if not note["paper"]:
+                for heading in note["headings"]:
+                    yield heading, f"{title}#{heading}", 2
+
+    def _build(self):
+        goto = [{}]     # node -> {word: node}
+        output = [None]  # node -> (words, target, rank, exact) of the term ending here
+        for term, target, rank in self._terms():
+            words = WORD_PATTERN.findall(term)
+            if not words or term.lower() in GENERIC_TERMS:
+                continue
+            exact = None
+            if "#" in target:
+                # "## Training" in a daily note isn't what "training" in a sentence means: headings
+                # need several words and only match as written
+                if len(words) < 2:
+                    continue
+                exact = tuple(words)
+            elif len(words) == 1 and len(words[0]) < 4:
+                # One short word only matches as written (acronyms like GAN, RNN)
+                if len(words[0]) < 2 or not words[0].isupper():
+                    continue
+                exact = tuple(words)
+            node = 0
+            for word in words:
+                word = word.lower()
+                if word not in goto[node]:
+                    goto.append({})
+                    output.append(None)
+                    goto[node][word] = len(goto) - 1
+                node = goto[node][word]
+            if output[node] is None or rank < output[node][2]:
+                output[node] = (len(words), target, rank, exact)
+
+        # Breadth-first failure links; dict_link points at the nearest suffix node that ends a term
+        fail = [0] * len(goto)
+        dict_link = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for word, child in goto[node].items():
+                state = fail[node]
+                while state and word not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(word, 0)
+                dict_link[child] = fail[child] if output[fail[child]] is not None else dict_link[fail[child]]
+                queue.append(child)
+        self._automaton = (goto, fail, output, dict_link)
+
+    def find(self, text: str, exclude=()):
+        """
+        Leftmost-longest, non-overlapping known concepts in text: [(start, end, target)].
+        """
+        if self._automaton is None:
+            self._build()
+        goto, fail, output, dict_link = self._automaton
+
+        words = [(m.start(), m.end(), m.group()) for m in WORD_PATTERN.finditer(text)]
+        matches = []  # (first word index, word count, target)
+        state = 0
+        for i, (_, _, word) in enumerate(words):
+            lowered = word.lower()
+            while state and lowered not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(lowered, 0)
+            node = state if output[state] is not None else dict_link[state]
+            while node:
+                count, target, _, exact = output[node]
+                if (exact is None or tuple(w for _, _, w in words[i - count + 1:i + 1]) == exact) \
+                        and target.split("#")[0] not in exclude:
+                    matches.append((i - count + 1, count, target))
+                node = dict_link[node]
+
+        found = []
+        next_free = 0
+        for first, count, target in sorted(matches, key=lambda m: (m[0], -m[1])):
+            if first >= next_free:
+                found.append((words[first][0], words[first + count - 1][1], target))
+                next_free = first + count
+        return found
+
+    def lookup(self, term: str):
+        """
+        The note a link text refers to, if the vault knows it under that title or alias.
+        """
+        words = list(WORD_PATTERN.finditer(term))
+        found = self.find(term)
+        if words and len(found) == 1 and found[0][:2] == (words[0].start(), words[-1].end()):
+            return found[0][2]
+        return None
+
+    def link(self, text: str, exclude=()) -> str:
+        """
+        Turns the first mention of each known concept into a wikilink, and points links
+        the model made up at the note they name ([[Transformer]] -> [[Transformers|Transformer]]).
+        Existing links, code and inline math are left alone.
+        """
+        protected = [(m.start(), m.end()) for m in PROTECTED_PATTERN.finditer(text)]
+        linked = {target for target in (self.lookup(m) for m in LINK_PATTERN.findall(text)) if target}
+
+        parts = []
+        position = 0
+        for start, end, target in self.find(text, exclude):
+            if target in linked or any(p_start < end and start < p_end for p_start, p_end in protected):
+                continue
+            linked.add(target)
+            parts.append(text[position:start])
+            parts.append(wikilink(target, text[start:end]))
+            position = end
+        parts.append(text[position:])
+        return resolve_links("".join(parts), self)
+
+    def top_concepts(self, text: str, count: int, exclude=()):
+        """
+        The count notes mentioned most often in text (ties: first mention first). Only titles
+        and aliases count: a heading of some other note isn't a concept of the paper.
+        """
+        mentions = {}
+        for start, _, target in self.find(text, exclude):
+            if "#" in target:
+                continue
+            total, first = mentions.get(target, (0, start))
+            mentions[target] = (total + 1, first)
+        ranked = sorted(mentions.items(), key=lambda kv: (-kv[1][0], kv[1][1]))
+        return [target for target, _ in ranked[:count]]
+
+
+def wikilink(target: str, label: str = None) -> str:
+    if label is None and "#" in target:
+        label = target.split("#", 1)[1]
+    if label is None or label == target:
+        return f"[[{target}]]"
+    return f"[[{target}|{label}]]"
+
+
+def resolve_links(text: str, index: ConceptIndex) -> str:
+    def resolve(match):
+        target = index.lookup(match.group(1))
+        if target is None or target == match.group(1):
+            return match.group(0)
+        return wikilink(target, match.group(1))
+
+    return LINK_PATTERN.sub(resolve, text)
+
+
+_indexes = {}
+
+
+def load_index(vault_path: str) -> ConceptIndex:
+    """
+    One index per vault per process, refreshed at most every REFRESH_INTERVAL seconds.
+    """
+    index = _indexes.get(vault_path)
+    if index is None:
+        index = _indexes[vault_path] = ConceptIndex(vault_path)
+    if index._automaton is None or time.monotonic() - index._refreshed > REFRESH_INTERVAL:
+        index.refresh()
+    return index
@@ -0,0 +1,194 @@
+import heapq
+import json
+import os
+import shutil
+import signal
+import threading
+import time
+
+# Sub-folders of the inbox and their priority (lower runs first)
+PRIORITIES = {"urgent": 0, "": 1, "later": 2}
+PROCESSED_DIR = "processed"
+FAILED_DIR = "failed"
+STATUS_FILE = ".status.json"
+
+
+class InboxQueue:
+    """
+    Finds PDFs dropped into the inbox (or its urgent/ and later/ sub-folders) by polling.
+
+    A file is only queued once its size and mtime are the same on two scans in a row,
+    so a PDF that is still being copied or synced isn't picked up half-written.
+    """
+
+    def __init__(self, inbox: str):
+        self.inbox = inbox
+        self._seen = {}      # path -> (size, mtime) from the previous scan
+        self._queued = set()
+        self._heap = []      # (priority, arrival, path)
+        self._arrivals = 0
+        for folder in PRIORITIES:
+            os.makedirs(os.path.join(inbox, folder), exist_ok=True)
+        os.makedirs(os.path.join(inbox, PROCESSED_DIR), exist_ok=True)
+        os.makedirs(os.path.join(inbox, FAILED_DIR), exist_ok=True)
+
+    def scan(self):
+        current = {}
+        for folder, priority in PRIORITIES.items():
+            directory = os.path.join(self.inbox, folder)
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if not name.lower().endswith(".pdf") or not os.path.isfile(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # moved away between listdir and stat
+                current[path] = (stat.st_size, stat.st_mtime_ns)
+                if path not in self._queued and self._seen.get(path) == current[path]:
+                    heapq.heappush(self._heap, (priority, self._arrivals, path))
+                    self._arrivals += 1
+                    self._queued.add(path)
+        self._seen = current
+
+    def pop_batch(self, max_batch: int):
+        """
+        Up to max_batch papers of the best priority waiting, in arrival order.
+        """
+        batch = []
+        while self._heap and len(batch) < max_batch:
+            if batch and self._heap[0][0] != batch[0][0]:
+                break
+            batch.append(heapq.heappop(self._heap))
+        return [path for _, _, path in batch]
+
+    def finish(self, path: str, failed: bool = False):
+        """
+        Moves a handled PDF out of the way (its copy lives in the vault assets already).
+        """
+        self._queued.discard(path)
+        target = os.path.join(self.inbox, FAILED_DIR if failed else PROCESSED_DIR, os.path.basename(path))
+        if os.path.exists(path):
+            shutil.move(path, target)
+
+    def waiting(self):
+        return [{"pdf": os.path.basename(path), "priority": priority} for priority, _, path in sorted(self._heap)]
+
+
+class DaemonStatus:
+    """
+    The daemon's state as a dict, mirrored to <inbox>/.status.json (atomically replaced)
+    and, optionally, served as JSON on http://127.0.0.1:<port>/.
+    """
+
+    def __init__(self, inbox: str, port: int = None):
+        self.path = os.path.join(inbox, STATUS_FILE)
+        self._lock = threading.Lock()
+        self.state = {
+            "pid": os.getpid(),
+            "started": time.time(),
+            "state": "idle",
+            "models_loaded": False,
+            "current": [],
+            "queue": [],
+            "processed": 0,
+            "failed": 0,
+            "last_activity": None,
+        }
+        self.server = None
+        if port:
+            from http.server import ThreadingHTTPServer
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+            threading.Thread(target=self.server.serve_forever, name="status-http", daemon=True).start()
+            print(f"Status on http://127.0.0.1:{port}/")
+
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+
+        status = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = status.to_json().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # keep the daemon's console for pipeline output
+
+        return Handler
+
+    def to_json(self) -> str:
+        with self._lock:
+            return json.dumps(self.state, indent=2)
+
+    def update(self, **changes):
+        with self._lock:
+            self.state.update(changes)
+            self.state["updated"] = time.time()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_json())
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.update(state="stopped", current=[])
+        if self.server is not None:
+            self.server.shutdown()
+
+
+def run_daemon(inbox: str, process_batch, unload_models, idle_timeout: float = 600, poll_interval: float = 2.0,
+               max_batch: int = 4, status_port: int = None):
+    """
+    Main loop: scan the inbox, run the best-priority batch through process_batch(pdf_paths)
+    (which returns the paths that failed), and call unload_models() once nothing has
+    happened for idle_timeout seconds. Stops cleanly on Ctrl-C / SIGTERM after the current batch.
+    """
+    queue = InboxQueue(inbox)
+    status = DaemonStatus(inbox, status_port)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    print(f"👀 Watching {inbox} (urgent/ and later/ for priorities)")
+
+    last_activity = time.monotonic()
+    models_loaded = False
+    status.update()
+    try:
+        while not stop.is_set():
+            queue.scan()
+            batch = queue.pop_batch(max_batch)
+            if not batch:
+                if models_loaded and time.monotonic() - last_activity > idle_timeout:
+                    print(f"Idle for {idle_timeout:.0f}s, unloading models")
+                    unload_models()
+                    models_loaded = False
+                status.update(state="idle", current=[], queue=queue.waiting(), models_loaded=models_loaded)
+                stop.wait(poll_interval)
+                continue
+
+            status.update(state="processing", current=[os.path.basename(p) for p in batch], queue=queue.waiting())
+            try:
+                failed = set(process_batch(batch))
+            except Exception as e:
+                print(f"Batch failed: {e}")
+                failed = set(batch)
+            for path in batch:
+                queue.finish(path, failed=path in failed)
+
+            models_loaded = True
+            last_activity = time.monotonic()
+            status.update(
+                processed=status.state["processed"] + len(batch) - len(failed),
+                failed=status.state["failed"] + len(failed),
+                last_activity=time.time(),
+                models_loaded=True,
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping daemon")
+        unload_models()
+        status.close()
@@ -0,0 +1,77 @@
+import ast
+import json
+import os
+
+# The training data for the adapters was generated with this prompt/schema (fineTune/sdg.py)
+SDG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fineTune", "sdg.py")
+
+_panel_spec = None
+
+
+def load_panel_spec(path: str = SDG_PATH):
+    """
+    Returns (panel_prompt, response_schema) from fineTune/sdg.py.
+
+    Read with ast instead of importing: importing sdg.py pulls in google-genai and
+    creates an API client at module level.
+    """
+    global _panel_spec
+    if _panel_spec is None:
+        with open(path, "r") as f:
+            tree = ast.parse(f.read(), filename=path)
+        found = {}
+        for node in tree.body:
+            if isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name) and target.id in ("panel_prompt", "response_schema"):
+                        found[target.id] = ast.literal_eval(node.value)
+        missing = {"panel_prompt", "response_schema"} - set(found)
+        if missing:
+            raise ValueError(f"{path} does not define {', '.join(sorted(missing))}")
+        _panel_spec = (found["panel_prompt"], found["response_schema"])
+    return _panel_spec
+
+
+def validate(value, schema: dict, path: str = "$"):
+    """
+    The subset of JSON schema that response_schema uses: objects, required keys, strings.
+    Raises ValueError with the offending path.
+    """
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict):
+            raise ValueError(f"{path}: expected an object")
+        for name in schema.get("required", []):
+            if name not in value:
+                raise ValueError(f"{path}: missing '{name}'")
+        for name, sub_schema in schema.get("properties", {}).items():
+            if name in value:
+                validate(value[name], sub_schema, f"{path}.{name}")
+    elif kind == "string":
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"{path}: expected a non-empty string")
+
+
+def parse_panel_response(text: str, schema: dict) -> dict:
+    """
+    Pulls the JSON object out of the model's answer (small models like to wrap it in
+    ```json fences or chat around it) and validates it against the schema.
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        raise ValueError("no JSON object in the response")
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError as e:
+        raise ValueError(f"invalid JSON: {e}")
+    validate(data, schema)
+    return data
+
+
+def format_perspective(style: str, data: dict, schema: dict) -> str:
+    """
+    Renders one perspective the way the adapters were trained to answer:
+    "**Analogy:** ...\n\n**Explanation:** ..."
+    """
+    fields = schema["properties"][style]["properties"]
+    return "\n\n".join(f"**{name.capitalize()}:** {data[style][name].strip()}" for name in fields)
@@ -0,0 +1,126 @@
+import os
+import tempfile
+
+# Calibrated on the figures pymupdf4llm extracts from fineTune/papers: real figures are
+# >= 85px on the short side, at most ~5:1 and have >= 5% of their pixels off the background.
+# Icons, rules, equation strips and blank boxes fall outside that.
+MIN_SIDE = 40
+MIN_PIXELS = 80 * 80
+MAX_ASPECT = 8.0
+# Share of pixels that must differ from the background (the most common grey level) by more
+# than BACKGROUND_TOLERANCE. Counts ink, not tones: black-on-white line art has few grey
+# levels but its lines and labels still cover a few percent of the image.
+MIN_CONTENT = 0.005
+BACKGROUND_TOLERANCE = 32
+
+# 16x16 difference hash (256 bits): distinct charts with the same layout are >= 13 bits
+# apart, the same picture re-encoded or re-cropped <= 3
+HASH_SIZE = 16
+NEAR_DUPLICATE_BITS = 6
+# The same picture linked this many times in one paper is a logo or running header
+REPEAT_LIMIT = 3
+
+# Qwen2-VL makes one token per 28x28 patch, so prefill cost grows with pixels: 1024x768 ~ 1000 tokens
+MAX_CAPTION_PIXELS = int(os.environ.get("PAPER_CAPTION_MAX_PIXELS", str(1024 * 768)))
+TRIAGE = os.environ.get("PAPER_IMAGE_TRIAGE", "1") != "0"
+
+
+def image_features(full_path: str) -> dict:
+    from PIL import Image
+
+    with Image.open(full_path) as image:
+        width, height = image.size
+        grey = image.convert("L")
+        histogram = grey.histogram()
+        background = max(range(256), key=histogram.__getitem__)
+        ink = sum(count for level, count in enumerate(histogram) if abs(level - background) > BACKGROUND_TOLERANCE)
+        pixels = list(grey.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).getdata())
+
+    dhash = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            dhash = (dhash << 1) | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return {"width": width, "height": height, "content": ink / (width * height), "dhash": dhash}
+
+
+def skip_reason(features: dict):
+    """
+    Why an image isn't worth a VLM call on its own, or None.
+    """
+    width, height = features["width"], features["height"]
+    if min(width, height) < MIN_SIDE or width * height < MIN_PIXELS:
+        return f"tiny ({width}x{height})"
+    if max(width, height) / min(width, height) > MAX_ASPECT:
+        return f"strip ({width}x{height}, rule or inline equation)"
+    if features["content"] < MIN_CONTENT:
+        return f"nearly blank ({100 * features['content']:.1f}% off the background)"
+    return None
+
+
+def near_duplicates(a: dict, b: dict) -> bool:
+    aspect_a, aspect_b = a["width"] / a["height"], b["width"] / b["height"]
+    if abs(aspect_a - aspect_b) > 0.05 * max(aspect_a, aspect_b):
+        return False
+    return bin(a["dhash"] ^ b["dhash"]).count("1") <= NEAR_DUPLICATE_BITS
+
+
+def triage_images(paths: dict) -> dict:
+    """
+    CPU pass over one paper's images ({rel_path: full_path}, in document order).
+
+    Returns:
+      "features": {rel_path: size / content / dhash}
+      "skipped":  {rel_path: reason} for decorative images that get no caption
+      "same_as":  {rel_path: rel_path of an earlier near-duplicate} to reuse its caption
+    """
+    features = {}
+    skipped = {}
+    for rel_path, full_path in paths.items():
+        try:
+            features[rel_path] = image_features(full_path)
+        except Exception as e:
+            # Let the VLM have a go at whatever PIL can't read
+            print(f"Can't triage {rel_path}: {e}")
+            continue
+        reason = skip_reason(features[rel_path])
+        if reason:
+            skipped[rel_path] = reason
+
+    # Group near-duplicates onto the first occurrence
+    groups = {}  # first rel_path -> [rel_paths]
+    for rel_path, feature in features.items():
+        if rel_path in skipped:
+            continue
+        first = next((f for f in groups if near_duplicates(features[f], feature)), rel_path)
+        groups.setdefault(first, []).append(rel_path)
+
+    same_as = {}
+    for first, members in groups.items():
+        if len(members) >= REPEAT_LIMIT:
+            for rel_path in members:
+                skipped[rel_path] = f"repeated {len(members)} times (logo or page header)"
+            continue
+        for rel_path in members[1:]:
+            same_as[rel_path] = first
+
+    return {"features": features, "skipped": skipped, "same_as": same_as}
+
+
+def downscale(full_path: str, features: dict, max_pixels: int = MAX_CAPTION_PIXELS):
+    """
+    Writes a copy of the image that fits in max_pixels to a temp file and returns its
+    path, or None if the image is small enough already.
+    """
+    from PIL import Image
+
+    pixels = features["width"] * features["height"]
+    if pixels <= max_pixels:
+        return None
+    scale = (max_pixels / pixels) ** 0.5
+    size = (max(1, int(features["width"] * scale)), max(1, int(features["height"] * scale)))
+    fd, path = tempfile.mkstemp(prefix="caption-", suffix=".png")
+    os.close(fd)
+    with Image.open(full_path) as image:
+        image.convert("RGB").resize(size, Image.LANCZOS).save(path)
+    return path
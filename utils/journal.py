@@ -0,0 +1,124 @@
+import glob
+import json
+import os
+import time
+from utils.cache import hash_file, hash_text
+
+JOURNAL_SUFFIX = ".journal.jsonl"
+
+
+class PaperJournal:
+    """
+    Append-only, fsync'd log of one paper's run: which (style, section) results are
+    finished (with their output), which failed, and whether the note was rendered.
+
+    Each line is a JSON record, so a crash can at worst lose the line being written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.results = {}   # (style, section, text_hash) -> output, from a previous run
+        self.failures = {}  # (style, section) -> error message
+        self.meta = {}
+        self.done = False
+
+    @classmethod
+    def start(cls, path: str, pdf_path: str, resume: bool = False):
+        """
+        Opens the journal for a run. With resume=True, completed results of the
+        previous run of the SAME pdf are loaded; otherwise the journal starts fresh.
+        """
+        journal = cls(path)
+        pdf_hash = hash_file(pdf_path)
+        if resume and os.path.exists(path):
+            journal._load()
+            if journal.meta.get("pdf_hash") != pdf_hash:
+                print(f"Journal {path} is for a different version of the PDF, starting fresh")
+                journal = cls(path)
+            else:
+                print(f"Resuming: {len(journal.results)} results already done")
+                journal.done = False
+                journal._append({"type": "resume", "time": time.time()})
+                return journal
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w"):
+            pass
+        journal.meta = {"type": "start", "pdf": os.path.abspath(pdf_path), "pdf_hash": pdf_hash, "time": time.time()}
+        journal._append(journal.meta)
+        return journal
+
+    @classmethod
+    def read(cls, path: str):
+        """
+        Loads a journal for inspection without starting a run.
+        """
+        journal = cls(path)
+        journal._load()
+        return journal
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line after a crash
+                kind = record.get("type")
+                if kind == "start":
+                    self.meta = record
+                elif kind == "result":
+                    self.results[(record["style"], record["section"], record["text_hash"])] = record["output"]
+                    self.failures.pop((record["style"], record["section"]), None)
+                elif kind == "failed":
+                    self.failures[(record["style"], record["section"])] = record["error"]
+                elif kind == "done":
+                    self.done = True
+
+    def _append(self, record: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get(self, style: str, section: str, text: str):
+        return self.results.get((style, section, hash_text(text)))
+
+    def has_output(self, style: str, section: str) -> bool:
+        """
+        Whether a previous run produced this style for this section, for any version of its text.
+        """
+        return any(key[:2] == (style, section) for key in self.results)
+
+    def record_result(self, style: str, section: str, text: str, output: str):
+        # Only written to disk: outputs of THIS run are never looked up again,
+        # so keeping them in memory would just grow with the paper
+        text_hash = hash_text(text)
+        self.failures.pop((style, section), None)
+        self._append({"type": "result", "style": style, "section": section, "text_hash": text_hash, "output": output})
+
+    def record_failure(self, style: str, section: str, error: str):
+        self.failures[(style, section)] = error
+        self._append({"type": "failed", "style": style, "section": section, "error": error})
+
+    def mark_done(self):
+        self.done = True
+        self._append({"type": "done", "time": time.time(), "failures": len(self.failures)})
+
+
+def unfinished_journals(vault_path: str):
+    """
+    Returns the PDF paths of every journal in the vault whose run never rendered its note,
+    or rendered it with missing results.
+    """
+    pdfs = []
+    for path in sorted(glob.glob(os.path.join(vault_path, "assets", "*", f"*{JOURNAL_SUFFIX}"))):
+        journal = PaperJournal.read(path)
+        if (journal.done and not journal.failures) or not journal.meta.get("pdf"):
+            continue
+        # Fall back to the copy we keep next to the assets if the original moved
+        pdf_path = journal.meta["pdf"]
+        if not os.path.exists(pdf_path):
+            pdf_path = path[: -len(JOURNAL_SUFFIX)] + ".pdf"
+        pdfs.append(pdf_path)
+    return pdfs
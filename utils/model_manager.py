@@ -0,0 +1,128 @@
+import json
+import os
+import mlx.core as mx
+from mlx_lm import load
+from mlx_lm.tuner.utils import linear_to_lora_layers
+from utils.tracing import TRACER
+
+
+class ModelManager:
+    """
+    Keeps ONE copy of the base model in RAM and hot-swaps the LoRA adapters into it.
+
+    mlx_lm.load(BASE_MODEL, adapter_path=...) re-reads and re-dequantizes the full
+    3B base weights every time. The adapters only differ in their tiny lora_a / lora_b
+    matrices (~8MB each), so we wrap the linear layers once and just swap those.
+    """
+
+    def __init__(self, base_model: str, adapters: dict):
+        self.base_model = base_model
+        self.adapters = adapters
+        self.model = None
+        self.tokenizer = None
+        self.active_adapter = None
+
+        self._lora_signature = None   # LoRA layout currently wrapped into the model
+        self._adapter_weights = {}    # name -> list of (param_name, mx.array)
+
+    def _load_base(self):
+        print(f"Loading base model {self.base_model}...")
+        with TRACER.span("load_model", model=self.base_model, kind="text"):
+            self.model, self.tokenizer = load(self.base_model)
+
+        # CRITICAL: Set EOS token for Llama 3
+        if "<|eot_id|>" in self.tokenizer.get_vocab():
+            self.tokenizer.eos_token_id = self.tokenizer.convert_tokens_to_ids("<|eot_id|>")
+            # batch_generate stops each sequence on tokenizer.eos_token_ids, which the line above doesn't touch
+            if hasattr(self.tokenizer, "add_eos_token"):
+                self.tokenizer.add_eos_token("<|eot_id|>")
+
+        self.active_adapter = None
+        self._lora_signature = None
+
+    def _read_adapter(self, name: str):
+        """
+        Reads adapter_config.json + adapters.safetensors once and keeps them in memory.
+        """
+        if name not in self._adapter_weights:
+            adapter_path = self.adapters[name]
+            with open(os.path.join(adapter_path, "adapter_config.json"), "r") as f:
+                config = json.load(f)
+
+            fine_tune_type = config.get("fine_tune_type", "lora")
+            if fine_tune_type != "lora":
+                raise ValueError(f"Adapter {name} is '{fine_tune_type}', only LoRA adapters can be hot-swapped")
+
+            lora_params = config["lora_parameters"]
+            signature = (
+                config["num_layers"],
+                lora_params["rank"],
+                lora_params["scale"],
+                lora_params.get("dropout", 0.0),
+                tuple(lora_params.get("keys") or ()),
+            )
+            weights = mx.load(os.path.join(adapter_path, "adapters.safetensors"))
+            self._adapter_weights[name] = (signature, config, list(weights.items()))
+
+        return self._adapter_weights[name]
+
+    def _wrap_lora_layers(self, signature, config):
+        if self._lora_signature == signature:
+            return
+
+        if self._lora_signature is not None:
+            # Different rank / layer count: the wrapped layers can't hold these weights.
+            # Start again from a clean base model.
+            self._load_base()
+
+        linear_to_lora_layers(self.model, config["num_layers"], config["lora_parameters"])
+        self._lora_signature = signature
+
+    def _zero_lora(self):
+        """
+        lora_b == 0 makes every LoRA delta vanish, so the model behaves like the plain base model.
+        """
+        zeros = []
+        for signature, _, weights in self._adapter_weights.values():
+            if signature != self._lora_signature:
+                continue
+            zeros = [(k, mx.zeros_like(v)) for k, v in weights if k.endswith("lora_b")]
+            break
+        if zeros:
+            self.model.load_weights(zeros, strict=False)
+            mx.eval(self.model.parameters())
+
+    def use_adapter(self, name: str = None):
+        """
+        Activates the named adapter (e.g. "eli5") and returns (model, tokenizer).
+        Passing None returns the plain base model.
+        """
+        if self.model is None:
+            self._load_base()
+
+        if name == self.active_adapter:
+            return self.model, self.tokenizer
+
+        if name is None:
+            self._zero_lora()
+        else:
+            print(f"Swapping in adapter: {name}")
+            with TRACER.span("swap_adapter", adapter=name):
+                signature, config, weights = self._read_adapter(name)
+                self._wrap_lora_layers(signature, config)
+                self.model.load_weights(weights, strict=False)
+                mx.eval(self.model.parameters())
+
+        self.model.eval()
+        self.active_adapter = name
+        return self.model, self.tokenizer
+
+    def unload(self):
+        """
+        Drops the base model (and cached adapter weights) so the memory can be reused.
+        """
+        self.model = None
+        self.tokenizer = None
+        self.active_adapter = None
+        self._lora_signature = None
+        self._adapter_weights = {}
@@ -0,0 +1,138 @@
+import os
+import time
+
+
+def render_section(header: str, visuals, styles: dict, style_config: dict) -> str:
+    """
+    One "## header" block: collapsed visuals, then one callout per style in STYLE_CONFIG order.
+    """
+    parts = [f"\n## {header}\n"]
+
+    if visuals:
+        parts.append("> [!ABSTRACT]- Visuals (Click to expand)\n")
+        for vis in visuals:
+            indented_vis = vis.replace("\n", "\n> ")
+            parts.append(f"> {indented_vis}\n> \n")
+        parts.append("---\n") # Separator line
+
+    for style, config in style_config.items():
+        parts.append(f"{config['callout']}\n")
+        if style in styles:
+            parts.append(f"> {styles[style]}\n\n")
+
+    return "".join(parts)
+
+
+def render_related(related) -> str:
+    """
+    "## Related papers" footer from [(safe_name, title, score, (own section, their section))].
+    """
+    if not related:
+        return ""
+    lines = ["\n## Related papers\n"]
+    for safe_name, title, score, (own, theirs) in related:
+        lines.append(f"- [[{safe_name}|{_label(title)}]] ({score:.2f}, *{_label(own)}* ~ *{_label(theirs)}*)\n")
+    return "".join(lines)
+
+
+def _label(text: str, limit: int = 60) -> str:
+    # Brackets and pipes would end the wikilink / italics early
+    text = " ".join(text.translate(str.maketrans("", "", "[]|*")).split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+class NoteWriter:
+    """
+    Writes a paper's note incrementally while generation is still running.
+
+    Every flush rewrites the note to a temp file and os.replace()s it, so Obsidian only
+    ever sees a complete (if partial) note. Sections that have all their styles are
+    rendered once and spooled to disk, so memory only holds the unfinished sections.
+    """
+
+    def __init__(self, output_file: str, title: str, safe_name: str, headers, header_visuals: dict,
+                 style_config: dict, flush_interval: float = 2.0):
+        self.output_file = output_file
+        self.title = title
+        self.safe_name = safe_name
+        self.headers = list(dict.fromkeys(headers))  # note order, one block per header
+        self.header_visuals = header_visuals
+        self.style_config = style_config
+        self.flush_interval = flush_interval
+        self.concepts = ""
+        self.related = []
+
+        self._pending = {}   # header -> {style: response} for unfinished sections
+        self._spooled = {}   # header -> (offset, length) of its rendered block in the spool file
+        self._spool_path = f"{output_file}.spool"
+        self._tmp_path = f"{output_file}.tmp"
+        self._last_flush = 0.0
+        open(self._spool_path, "w").close()
+
+    def set_concepts(self, concepts: str):
+        self.concepts = concepts
+        self.maybe_flush()
+
+    def set_related(self, related):
+        self.related = related
+
+    def add(self, header: str, style: str, response: str):
+        """
+        response is the already "> "-indented callout body.
+        """
+        styles = self._pending.setdefault(header, {})
+        styles[style] = response
+        if all(s in styles for s in self.style_config):
+            self._spool(header)
+        self.maybe_flush()
+
+    def _spool(self, header: str):
+        block = render_section(header, self.header_visuals.get(header), self._pending.pop(header), self.style_config)
+        data = block.encode("utf-8")
+        with open(self._spool_path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+        self._spooled[header] = (offset, len(data))
+
+    def _header_block(self) -> str:
+        return (
+            f"# {self.title}\n"
+            f"**Connected Concepts:** {self.concepts}\n\n"
+            f"[[assets/{self.safe_name}/{self.safe_name}.pdf|{self.safe_name}]] (PDF Source)\n\n---\n"
+        )
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Streams the current note into a temp file and atomically swaps it in.
+        Sections without any output yet are left out.
+        """
+        with open(self._tmp_path, "wb") as out, open(self._spool_path, "rb") as spool:
+            out.write(self._header_block().encode("utf-8"))
+            for header in self.headers:
+                if header in self._spooled:
+                    offset, length = self._spooled[header]
+                    spool.seek(offset)
+                    out.write(spool.read(length))
+                elif header in self._pending:
+                    block = render_section(header, self.header_visuals.get(header), self._pending[header], self.style_config)
+                    out.write(block.encode("utf-8"))
+            out.write(render_related(self.related).encode("utf-8"))
+        os.replace(self._tmp_path, self.output_file)
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+
+    def discard(self):
+        """
+        Drops everything without touching the note on disk.
+        """
+        for path in (self._spool_path, self._tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Pages converted per worker task. Small enough that a few slow (figure-heavy) pages
+# don't leave the other workers idle at the end, big enough to amortize opening the PDF.
+PAGES_PER_SHARD = int(os.environ.get("PAPER_PAGES_PER_SHARD", "8"))
+# 1 = convert in this process, like plain pymupdf4llm.to_markdown
+PARSE_WORKERS = int(os.environ.get("PAPER_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+MARKDOWN_OPTIONS = {"write_images": True, "image_format": "png"}
+
+_pool = None
+
+
+def _get_pool():
+    # One pool for the whole process, so batch and daemon runs don't pay the worker startup per paper.
+    # spawn: the pool is created from the prefetch thread, and forking a threaded process isn't safe
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    """
+    Stops the parse workers and waits for them to exit (the next to_markdown starts new ones).
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def _convert_shard(pdf_path: str, pages: list, image_path: str, hdr_info) -> str:
+    import pymupdf4llm
+    return pymupdf4llm.to_markdown(pdf_path, pages=pages, image_path=image_path, hdr_info=hdr_info, **MARKDOWN_OPTIONS)
+
+
+def page_shards(page_count: int, pages_per_shard: int = PAGES_PER_SHARD):
+    return [list(range(start, min(start + pages_per_shard, page_count))) for start in range(0, page_count, pages_per_shard)]
+
+
+def to_markdown(pdf_path: str, image_path: str) -> str:
+    """
+    pymupdf4llm.to_markdown, with the pages converted in shards across a process pool
+    and stitched back together in page order.
+
+    The output matches one whole-document call in everything that matters downstream,
+    but not byte for byte:
+    - header levels come from font sizes over the WHOLE document (computed once here),
+      not per shard, so a "##" on page 3 and page 300 mean the same thing
+    - pymupdf4llm names images <pdf name>-<page number>-<index>.png with the absolute
+      page number, so image file names don't depend on the sharding
+    - the markdown of each shard is just concatenated in page order
+    It is not byte for byte the same, though. pymupdf4llm lays some pages out slightly
+    differently when it only gets a subset of the document: an image can move a few lines
+    within its page and blank lines around images and tables can differ. It isn't fully
+    stable on some PDFs even in one process, either. Section texts on those pages then hash
+    differently, which is why run keeps its markdown for render (CAPTIONED_SUFFIX).
+    """
+    import pymupdf
+    from pymupdf4llm.helpers.pymupdf_rag import IdentifyHeaders
+
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+        # Reflowable documents (epub, ...) get re-laid-out by pymupdf4llm, their pages aren't stable
+        shardable = doc.is_pdf
+        hdr_info = IdentifyHeaders(doc)
+
+    shards = page_shards(page_count)
+    # Workers would race to create the image folder
+    os.makedirs(image_path, exist_ok=True)
+    if PARSE_WORKERS <= 1 or len(shards) <= 1 or not shardable:
+        return _convert_shard(pdf_path, None, image_path, hdr_info)
+
+    n = len(shards)
+    return "".join(_get_pool().map(_convert_shard, [pdf_path] * n, shards, [image_path] * n, [hdr_info] * n))
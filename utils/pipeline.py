@@ -0,0 +1,78 @@
+import queue
+import threading
+
+# Marks the end of a stream on the queues below
+_DONE = object()
+
+
+def prefetch(func, items, queue_size: int = 2):
+    """
+    Runs func over items on a background thread and yields (item, result, error) in order.
+
+    At most queue_size finished results wait in the queue, so a fast producer (PDF parsing)
+    can't run ahead and fill RAM while the consumer (model inference) is busy.
+    """
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def producer():
+        for item in items:
+            if stop.is_set():
+                break
+            try:
+                results.put((item, func(item), None))
+            except Exception as e:
+                results.put((item, None, e))
+        results.put(_DONE)
+
+    thread = threading.Thread(target=producer, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = results.get()
+            if entry is _DONE:
+                break
+            yield entry
+    finally:
+        # Consumer stopped early: let the producer finish its current item and exit
+        stop.set()
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class BackgroundWorker:
+    """
+    One consumer thread fed through a bounded queue (e.g. writing finished notes to disk
+    while the next paper is generating). submit() blocks when the queue is full.
+    """
+
+    def __init__(self, func, queue_size: int = 4, name: str = "worker"):
+        self.func = func
+        self.errors = []
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                break
+            try:
+                self.func(item)
+            except Exception as e:
+                print(f"Failed in {self._thread.name}: {e}")
+                self.errors.append((item, e))
+
+    def submit(self, item):
+        self._queue.put(item)
+
+    def close(self):
+        """
+        Waits until everything submitted so far has been processed.
+        """
+        self._queue.put(_DONE)
+        self._thread.join()
@@ -0,0 +1,161 @@
+import os
+import re
+
+# Comma-separated steps to run on section text before it goes into a prompt ("" or "0" = off)
+STEPS = ("figures", "citations", "tables", "whitespace")
+COMPRESSION = [s.strip() for s in os.environ.get("PAPER_PROMPT_COMPRESSION", ",".join(STEPS)).split(",") if s.strip() not in ("", "0")]
+
+# A figure becomes one line with the start of its caption: the note shows the full figure anyway
+MAX_FIGURE_CHARS = 200
+# Rows kept per table (after the header); the rest are counted, not shown
+MAX_TABLE_ROWS = 6
+
+IMAGE_PATTERN = re.compile(r"^[ \t]*!\[[^\]]*\]\([^)]*\)[ \t]*$", re.MULTILINE)
+CAPTION_LINE_PATTERN = re.compile(r"^>\s?\*?(.*?)\*?\s*$")
+# [3], [3, 7], [12-15], [10]–[14], [11], [12]: only after whitespace / punctuation, so x[1] or A[i, j] is left alone
+CITATION_BRACKET = r"\[\d{1,3}(?:\s*[,–\-]\s*\d{1,3})*\]"
+NUMERIC_CITATION_PATTERN = re.compile(
+    rf"(?:[ \t]+|(?<![\w\]\)])){CITATION_BRACKET}(?:\s*[,–\-]\s*{CITATION_BRACKET})*(?!\()"
+)
+# "[3] A. Author, ..." at the start of a line: an entry of a numbered reference list
+REFERENCE_ENTRY_PATTERN = re.compile(r"^\[(\d{1,3})\][ \t]+\S", re.MULTILINE)
+# "lie in [1, 10]", "k in [2-4] layers": a two-number bracket after these is an interval, whatever the references say
+INTERVAL_PATTERN = re.compile(r"(?:\b(?:in|within|between|from|over|range|interval)|[∈=])[ \t]*$", re.IGNORECASE)
+# (Smith et al., 2020), (Smith and Doe 2019; Lee 2021); names need a lower-case letter, so (WASA 2024) stays
+AUTHOR = r"[A-Z][^\W\dA-Z_][\w\-']*"
+AUTHOR_CITATION_PATTERN = re.compile(
+    rf"[ \t]*\((?:{AUTHOR}(?: et al\.| and {AUTHOR})?,? \d{{4}}[a-z]?(?:;\s*)?)+\)"
+)
+# Inline math and code may contain anything that looks like a citation
+PROTECTED_PATTERN = re.compile(r"\$[^$\n]*\$|`[^`\n]*`")
+TABLE_ROW_PATTERN = re.compile(r"^\|.*\|[ \t]*$")
+TABLE_RULE_PATTERN = re.compile(r"^\|[\s:\-|]+\|[ \t]*$")
+
+
+def estimate_tokens(text: str) -> int:
+    # Same ~4 characters per token as the OpenAI/stub backends: the MLX tokenizer would mean loading the model
+    return (len(text) + 3) // 4
+
+
+def compress_figures(text: str) -> str:
+    """
+    ![](path) + its AI Vision callout -> [Figure: first MAX_FIGURE_CHARS of the caption].
+    Images without a caption are dropped.
+    """
+    lines = text.split("\n")
+    out = []
+    i = 0
+    while i < len(lines):
+        if not IMAGE_PATTERN.match(lines[i]):
+            out.append(lines[i])
+            i += 1
+            continue
+        j = i + 1
+        caption = []
+        while j < len(lines) and lines[j].strip().startswith(">"):
+            line = lines[j].strip()
+            if "[!INFO]" not in line:
+                caption.append(CAPTION_LINE_PATTERN.match(line).group(1))
+            j += 1
+        caption = " ".join(c for c in caption if c).strip()
+        if caption:
+            if len(caption) > MAX_FIGURE_CHARS:
+                caption = caption[:MAX_FIGURE_CHARS].rsplit(" ", 1)[0] + "…"
+            out.append(f"[Figure: {caption}]")
+        i = j
+    return "\n".join(out)
+
+
+def reference_numbers(markdown: str) -> set:
+    """
+    Numbers of the paper's "[n] ..." reference entries. Empty when the references aren't numbered.
+    """
+    return {int(n) for n in REFERENCE_ENTRY_PATTERN.findall(markdown)}
+
+
+def compress_citations(text: str, references=()) -> str:
+    """
+    Numeric brackets are only removed when every number in them is a reference entry, so without
+    numbered references [1, 10] and [2-4] always stay.
+    """
+    def strip(segment):
+        segment = NUMERIC_CITATION_PATTERN.sub(
+            lambda m: "" if _is_citation(m, segment, references) else m.group(), segment
+        )
+        return AUTHOR_CITATION_PATTERN.sub("", segment)
+
+    parts = []
+    position = 0
+    for match in PROTECTED_PATTERN.finditer(text):
+        parts.append(strip(text[position:match.start()]))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(strip(text[position:]))
+    return "".join(parts)
+
+
+def _is_citation(match, segment: str, references) -> bool:
+    numbers = [int(n) for n in re.findall(r"\d+", match.group())]
+    # [0, 1] or [1, 500] can't be references when the list has no entry 0 or 500
+    if not all(n in references for n in numbers):
+        return False
+    return len(numbers) != 2 or not INTERVAL_PATTERN.search(segment[:match.start()])
+
+
+def compress_tables(text: str) -> str:
+    """
+    Keeps each table's header and first MAX_TABLE_ROWS rows, drops empty rows and <br>s.
+    """
+    lines = text.split("\n")
+    out = []
+    i = 0
+    while i < len(lines):
+        if not TABLE_ROW_PATTERN.match(lines[i]):
+            out.append(lines[i])
+            i += 1
+            continue
+        j = i
+        while j < len(lines) and TABLE_ROW_PATTERN.match(lines[j]):
+            j += 1
+        rows = [row.replace("<br>", " ") for row in lines[i:j] if row.strip("| \t")]
+        header = rows[:2] if len(rows) > 1 and TABLE_RULE_PATTERN.match(rows[1]) else rows[:1]
+        body = rows[len(header):]
+        out += header + body[:MAX_TABLE_ROWS]
+        if len(body) > MAX_TABLE_ROWS:
+            out.append(f"({len(body) - MAX_TABLE_ROWS} more rows)")
+        i = j
+    return "\n".join(out)
+
+
+def compress_whitespace(text: str) -> str:
+    text = re.sub(r"(?<=\S)[ \t]{2,}", " ", text)
+    text = re.sub(r"[ \t]+$", "", text, flags=re.MULTILINE)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+COMPRESSORS = {
+    "figures": compress_figures,
+    "citations": compress_citations,
+    "tables": compress_tables,
+    "whitespace": compress_whitespace,
+}
+
+
+def compress_section(text: str, steps=None, references=()) -> str:
+    """
+    The section text as the LLM gets it. Whitespace goes last: the other steps leave gaps.
+    references: reference_numbers() of the whole paper, for the citations step.
+    """
+    steps = COMPRESSION if steps is None else steps
+    for name in STEPS:
+        if name in steps:
+            text = compress_citations(text, references) if name == "citations" else COMPRESSORS[name](text)
+    return text
+
+
+def check_steps(steps=None):
+    """
+    Names in PAPER_PROMPT_COMPRESSION that aren't compression steps.
+    """
+    return [name for name in (COMPRESSION if steps is None else steps) if name not in COMPRESSORS]
@@ -0,0 +1,258 @@
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from utils.cache import CACHE_ROOT, hash_text
+
+INDEX_DIR = os.path.join(CACHE_ROOT, "vectors")
+INDEX_VERSION = 1
+# "hashed" (no downloads) or "st:<model>" for a local sentence-transformers model
+EMBEDDER = os.environ.get("PAPER_EMBEDDER", "hashed")
+RELATED_INDEX = os.environ.get("PAPER_RELATED", "1") != "0"
+
+# Rows scored per step: bounds the RAM of a search however big the vault gets
+BLOCK_ROWS = 16384
+# Rewrite the vector file once more than this share of it belongs to replaced papers
+COMPACT_RATIO = 0.5
+# Only this much of a section is embedded (its start says what it's about)
+MAX_SECTION_CHARS = 4000
+
+WORD_PATTERN = re.compile(r"[a-z][a-z0-9]{2,}")
+STOPWORDS = set("""
+the and for are with that this from which these those their there then than into onto over under have has had
+was were been being not but can could would should will may might also such each both any all our its his her
+they them then when where while what who whom how why more most less least very much many some other another
+use used using based show shows shown given thus hence however therefore section figure table paper work let
+""".split())
+
+
+class HashedNgramEmbedder:
+    """
+    Word unigrams + bigrams hashed into a fixed number of signed buckets, log-scaled and
+    L2-normalized. Needs nothing to download; good enough to tell topics apart.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.name = f"hashed-ngrams-{dim}"
+
+    def embed(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = [w for w in WORD_PATTERN.findall(text.lower()) if w not in STOPWORDS]
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            if not features:
+                continue
+            # crc32, not hash(): it has to be the same in every process
+            hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+            signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[i], hashes % self.dim, signs)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """
+    Any local sentence-transformers model (PAPER_EMBEDDER=st:all-MiniLM-L6-v2).
+    """
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts) -> np.ndarray:
+        return self.model.encode(list(texts), normalize_embeddings=True).astype(np.float32)
+
+
+def make_embedder(spec: str = EMBEDDER):
+    if spec == "hashed":
+        return HashedNgramEmbedder()
+    if spec.startswith("st:"):
+        return SentenceTransformerEmbedder(spec[3:])
+    raise ValueError(f"Unknown PAPER_EMBEDDER '{spec}', expected 'hashed' or 'st:<model>'")
+
+
+def index_dir(vault_path: str) -> str:
+    return os.path.join(INDEX_DIR, hash_text(os.path.abspath(vault_path))[:16])
+
+
+class RelatedIndex:
+    """
+    Section embeddings of every paper note in the vault, in one float16 matrix on disk
+    (vectors.f16, read through np.memmap) plus a small JSON table of which rows belong
+    to which paper.
+
+    A rewritten paper appends its new rows and orphans the old ones, so an update never
+    rewrites the matrix (until orphans pass COMPACT_RATIO). So does a paper whose note was
+    deleted from the vault. Searches stream the matrix in BLOCK_ROWS blocks, so RAM stays
+    flat at 10k+ papers.
+    """
+
+    def __init__(self, vault_path: str, embedder):
+        self.vault_path = vault_path
+        self.embedder = embedder
+        self.dir = index_dir(vault_path)
+        self.vectors_path = os.path.join(self.dir, "vectors.f16")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self._lock = threading.Lock()
+
+        self.meta = {"version": INDEX_VERSION, "embedder": embedder.name, "dim": embedder.dim, "rows": 0, "papers": {}}
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            if (meta.get("version"), meta.get("embedder"), meta.get("dim")) == (INDEX_VERSION, embedder.name, embedder.dim):
+                self.meta = meta
+            else:
+                print(f"Related-paper index was built with {meta.get('embedder')}, rebuilding with {embedder.name}")
+        except (OSError, ValueError):
+            pass
+
+    def _save_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _matrix(self):
+        rows = self.meta["rows"]
+        if not rows:
+            return np.zeros((0, self.embedder.dim), dtype=np.float16)
+        return np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(rows, self.embedder.dim))
+
+    def _row_papers(self, names):
+        """
+        Paper slot of every row (len(names) = rows of replaced papers).
+        """
+        owners = np.full(self.meta["rows"], len(names), dtype=np.int32)
+        for slot, name in enumerate(names):
+            paper = self.meta["papers"][name]
+            owners[paper["start"]:paper["start"] + paper["count"]] = slot
+        return owners
+
+    def add_paper(self, name: str, title: str, sections) -> bool:
+        """
+        Embeds the paper's sections [(header, text)] and appends them. Returns False
+        (and does nothing) if the same sections are indexed already.
+        """
+        texts = [text[:MAX_SECTION_CHARS] for _, text in sections]
+        content_hash = hash_text(json.dumps(texts))
+        with self._lock:
+            known = self.meta["papers"].get(name)
+            if known and known["hash"] == content_hash:
+                if known["title"] != title:
+                    known["title"] = title
+                    self._save_meta()
+                return False
+            if not texts:
+                return False
+
+            vectors = self.embedder.embed(texts).astype(np.float16)
+            os.makedirs(self.dir, exist_ok=True)
+            with open(self.vectors_path, "ab") as f:
+                # Drop rows a crash left behind after the last saved meta
+                f.truncate(self.meta["rows"] * self.embedder.dim * 2)
+                f.write(vectors.tobytes())
+            self.meta["papers"][name] = {
+                "title": title, "start": self.meta["rows"], "count": len(texts),
+                "headers": [header for header, _ in sections], "hash": content_hash,
+            }
+            self.meta["rows"] += len(texts)
+            self._compact_if_needed()
+            self._save_meta()
+        return True
+
+    def _compact_if_needed(self):
+        live = sum(paper["count"] for paper in self.meta["papers"].values())
+        if self.meta["rows"] - live > COMPACT_RATIO * self.meta["rows"]:
+            self._compact()
+
+    def _drop_missing(self, keep: str):
+        """
+        Forgets papers whose note isn't in the vault any more, so no note links to them.
+        """
+        missing = [
+            name for name in self.meta["papers"]
+            if name != keep and not os.path.exists(os.path.join(self.vault_path, f"{name}.md"))
+        ]
+        if not missing:
+            return
+        for name in missing:
+            del self.meta["papers"][name]
+        print(f"Related papers: dropped {len(missing)} paper(s) whose note is gone")
+        self._compact_if_needed()
+        self._save_meta()
+
+    def _compact(self):
+        matrix = self._matrix()
+        tmp_path = f"{self.vectors_path}.tmp"
+        start = 0
+        with open(tmp_path, "wb") as f:
+            for paper in self.meta["papers"].values():
+                f.write(np.asarray(matrix[paper["start"]:paper["start"] + paper["count"]]).tobytes())
+                paper["start"] = start
+                start += paper["count"]
+        del matrix
+        os.replace(tmp_path, self.vectors_path)
+        self.meta["rows"] = start
+
+    def related(self, name: str, count: int = 5):
+        """
+        The count papers closest to this one: [(name, title, score, (own section, their section))].
+
+        Score = how well the other paper covers this one: for each of this paper's sections
+        its best matching section over there, averaged.
+        """
+        with self._lock:
+            self._drop_missing(keep=name)
+            paper = self.meta["papers"].get(name)
+            names = [other for other in self.meta["papers"] if other != name]
+            if paper is None or not names:
+                return []
+            matrix = self._matrix()
+            owners = self._row_papers(names)
+            query = np.asarray(matrix[paper["start"]:paper["start"] + paper["count"]], dtype=np.float32)
+
+            # best[q, p] = best similarity of query section q with any section of paper p
+            best = np.full((len(query), len(names) + 1), -1.0, dtype=np.float32)
+            for block_start in range(0, self.meta["rows"], BLOCK_ROWS):
+                block = np.asarray(matrix[block_start:block_start + BLOCK_ROWS], dtype=np.float32)
+                block_owners = owners[block_start:block_start + BLOCK_ROWS]
+                similarities = query @ block.T
+                # A paper's rows are contiguous, so reduce each run of rows in one go
+                starts = np.flatnonzero(np.r_[True, block_owners[1:] != block_owners[:-1]])
+                run_best = np.maximum.reduceat(similarities, starts, axis=1)
+                run_owners = block_owners[starts]
+                best[:, run_owners] = np.maximum(best[:, run_owners], run_best)
+
+            scores = best[:, :-1].mean(axis=0)
+            top = np.argsort(-scores)[:count]
+
+            results = []
+            for slot in top:
+                if scores[slot] <= 0:
+                    break
+                other = self.meta["papers"][names[slot]]
+                theirs = np.asarray(matrix[other["start"]:other["start"] + other["count"]], dtype=np.float32)
+                q, r = np.unravel_index(np.argmax(query @ theirs.T), (len(query), len(theirs)))
+                via = (paper["headers"][q], other["headers"][r])
+                results.append((names[slot], other["title"], round(float(scores[slot]), 3), via))
+            del matrix
+        return results
+
+
+_indexes = {}
+
+
+def load_related_index(vault_path: str) -> RelatedIndex:
+    index = _indexes.get(vault_path)
+    if index is None:
+        index = _indexes[vault_path] = RelatedIndex(vault_path, make_embedder())
+    return index
@@ -0,0 +1,152 @@
+import glob
+import json
+import os
+from collections import OrderedDict
+from utils.cache import CACHE_ROOT
+from utils.tracing import TRACER
+
+GB = 1024 ** 3
+
+# Budget = min(MAX_MEMORY_FRACTION of RAM, RAM - MEMORY_RESERVE_GB). 0.75 is about where
+# Metal caps the GPU working set, the reserve is macOS, Obsidian, a browser and the file
+# cache. 16GB -> 4GB (one model at a time, as before), 32GB -> 20GB, 64GB -> 48GB.
+MAX_MEMORY_FRACTION = 0.75
+MEMORY_RESERVE_GB = float(os.environ.get("PAPER_MEMORY_RESERVE_GB", "12"))
+# Set to use a fixed budget instead
+MEMORY_BUDGET_GB = os.environ.get("PAPER_MEMORY_BUDGET_GB")
+
+# A loaded model needs more than its weights: KV cache, activations, the image encoder
+WORKING_MEMORY = 1.5
+# Weights of the default models (4-bit), for when they aren't downloaded / measured yet
+FALLBACK_WEIGHTS_GB = {"vision": 1.3, "text": 1.8, "draft": 0.7}
+
+FOOTPRINTS_PATH = os.path.join(CACHE_ROOT, "footprints.json")
+
+
+def system_memory() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 16 * GB  # assume the smallest machine we support
+
+
+def memory_budget() -> int:
+    if MEMORY_BUDGET_GB:
+        return int(float(MEMORY_BUDGET_GB) * GB)
+    total = system_memory()
+    return max(0, int(min(total * MAX_MEMORY_FRACTION, total - MEMORY_RESERVE_GB * GB)))
+
+
+def weights_on_disk(model_id: str):
+    """
+    Size of a model's weight files: a local folder, or its snapshot in the Hugging Face cache.
+    None if it isn't downloaded.
+    """
+    if os.path.isdir(model_id):
+        folders = [model_id]
+    else:
+        hub = os.environ.get("HF_HUB_CACHE") or os.path.join(
+            os.environ.get("HF_HOME", os.path.join(os.path.expanduser("~"), ".cache", "huggingface")), "hub"
+        )
+        folders = glob.glob(os.path.join(hub, f"models--{model_id.replace('/', '--')}", "snapshots", "*"))
+    for folder in folders:
+        files = glob.glob(os.path.join(folder, "*.safetensors"))
+        if files:
+            return sum(os.path.getsize(f) for f in files)
+    return None
+
+
+def mlx_active_memory() -> int:
+    import mlx.core as mx
+    get_active_memory = getattr(mx, "get_active_memory", None) or mx.metal.get_active_memory
+    return get_active_memory()
+
+
+class ResidencyScheduler:
+    """
+    Keeps track of which models are in memory and what they cost, against a memory budget.
+
+    Backends load their models through load(); if the new model doesn't fit next to the
+    resident ones, the least recently used are unloaded first. A model's footprint is
+    estimated from its weights (x WORKING_MEMORY) until it has been loaded once, then the
+    measured growth of MLX active memory is used (kept in FOOTPRINTS_PATH across runs).
+    """
+
+    def __init__(self, budget: int = None):
+        self.budget = memory_budget() if budget is None else budget
+        self.resident = OrderedDict()  # name -> {"model", "bytes", "unload"}, least recently used first
+        self.measured = {}             # model_id -> bytes
+        try:
+            with open(FOOTPRINTS_PATH, "r") as f:
+                self.measured = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def footprint(self, name: str, model_id: str) -> int:
+        if model_id in self.measured:
+            return self.measured[model_id]
+        weights = weights_on_disk(model_id)
+        if weights is None:
+            weights = FALLBACK_WEIGHTS_GB.get(name, 2.0) * GB
+        return int(weights * WORKING_MEMORY)
+
+    def used(self) -> int:
+        return sum(entry["bytes"] for entry in self.resident.values())
+
+    def fits(self, models) -> bool:
+        """
+        Whether these (name, model_id) can all be resident at once.
+        """
+        return sum(self.footprint(name, model_id) for name, model_id in models) <= self.budget
+
+    def make_room(self, name: str, needed: int):
+        # Evicting the last resident model is pointless: the new one has to load either way
+        while self.resident and self.used() + needed > self.budget:
+            victim, entry = next(iter(self.resident.items()))
+            if victim == name:
+                break
+            print(f"♻️ Unloading {entry['model']} to make room for {name} "
+                  f"({(self.used() + needed) / GB:.1f} GB needed, budget {self.budget / GB:.1f} GB)")
+            with TRACER.span("evict_model", model=entry["model"], freed_mb=entry["bytes"] // 2 ** 20):
+                del self.resident[victim]
+                entry["unload"]()
+
+    def load(self, name: str, model_id: str, loader, unload, measure=None):
+        """
+        Runs loader() once there is room for the model and registers it. unload() must drop
+        the model; it is called when the model gets evicted.
+        """
+        needed = self.footprint(name, model_id)
+        self.make_room(name, needed)
+        before = measure() if measure else None
+        result = loader()
+        if measure:
+            grown = measure() - before
+            if grown > 0:
+                needed = int(grown * WORKING_MEMORY)
+                self._remember(model_id, needed)
+        self.resident[name] = {"model": model_id, "bytes": needed, "unload": unload}
+        return result
+
+    def _remember(self, model_id: str, footprint: int):
+        if self.measured.get(model_id) == footprint:
+            return
+        self.measured[model_id] = footprint
+        os.makedirs(CACHE_ROOT, exist_ok=True)
+        tmp_path = f"{FOOTPRINTS_PATH}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.measured, f, indent=2)
+        os.replace(tmp_path, FOOTPRINTS_PATH)
+
+    def touch(self, name: str):
+        if name in self.resident:
+            self.resident.move_to_end(name)
+
+    def release(self, name: str):
+        """
+        Called by a backend's own unload(), so an evicted or idle-unloaded model stops counting.
+        """
+        self.resident.pop(name, None)
+
+
+RESIDENCY = ResidencyScheduler()
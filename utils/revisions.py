@@ -0,0 +1,56 @@
+import json
+import os
+
+SECTIONS_SUFFIX = ".sections.json"
+
+
+class SectionState:
+    """
+    Sidecar kept next to a paper's assets (assets/<paper>/<paper>.sections.json).
+
+    It maps the generation key of every (style, section) output that went into the note
+    (the key covers the section text hash, adapter and prompt) to that output, plus the
+    captions by image hash. When a revised version of the paper comes in, unchanged
+    sections are rendered from here byte-for-byte and only changed ones are regenerated;
+    only images with new bytes go to the VLM.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.previous = {"outputs": {}, "captions": {}}
+        self.current = {"outputs": {}, "captions": {}}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.previous.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable {path}: {e}")
+
+    @property
+    def known_captions(self) -> dict:
+        return self.previous["captions"]
+
+    def get(self, key: str):
+        return self.previous["outputs"].get(key)
+
+    def record(self, key: str, output: str):
+        self.current["outputs"][key] = output
+
+    def record_captions(self, captions_by_hash: dict):
+        self.current["captions"].update(captions_by_hash)
+
+    def keep_outputs(self):
+        # For a save that doesn't regenerate anything (caption): the note still has them
+        self.current["outputs"].update(self.previous["outputs"])
+
+    def count_unchanged(self, keys) -> int:
+        return sum(1 for key in keys if key in self.previous["outputs"])
+
+    def save(self):
+        """
+        Writes only what was recorded this run: outputs and captions the paper no longer uses drop out.
+        """
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.current, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,215 @@
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Generations whose output is mostly the same 4 words over and over are flagged by summarize
+REPETITION_WARNING = 0.5
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """
+    Peak RSS of this process, or with children=True of the largest child process that has
+    exited and been waited for (e.g. a parse pool worker after shutdown_pool).
+    """
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def repetition_ratio(text: str, n: int = 4) -> float:
+    """
+    Share of word n-grams that already appeared earlier in the text.
+    ~0 for normal prose, close to 1 for a model stuck in a loop.
+    """
+    words = text.split()
+    ngrams = [tuple(words[i:i + n]) for i in range(len(words) - n + 1)]
+    if not ngrams:
+        return 0.0
+    return round(1 - len(set(ngrams)) / len(ngrams), 3)
+
+
+class Span:
+    __slots__ = ("name", "attrs")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """
+    Records timed spans (stages, model loads, model calls) and streams them out as
+    JSON lines and/or a Chrome trace-event file (chrome://tracing, ui.perfetto.dev).
+
+    Disabled by default: span() is then a no-op, so instrumented code costs nothing.
+    Both outputs are written as spans finish, so a crashed run still leaves a usable trace.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._jsonl = None
+        self._chrome = None
+        self._chrome_first = True
+        self._named_threads = set()
+        self._t0 = time.perf_counter()
+
+    def configure(self, jsonl_path: str = None, chrome_path: str = None):
+        self.close()
+        if jsonl_path:
+            self._jsonl = open(jsonl_path, "w", buffering=1)
+        if chrome_path:
+            # JSON array format: the viewers accept it without the closing "]" if we die mid-run
+            self._chrome = open(chrome_path, "w")
+            self._chrome.write("[\n")
+            self._chrome_first = True
+        self._named_threads = set()
+        self._t0 = time.perf_counter()
+        self.enabled = bool(self._jsonl or self._chrome)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """
+        with TRACER.span("generate", adapter="eli5") as span:
+            ...
+            span.set(generated_tokens=123)
+        """
+        if not self.enabled:
+            yield _NULL_SPAN
+            return
+
+        span = Span(name, attrs)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self._finish(span, start, time.perf_counter())
+
+    def _finish(self, span: Span, start: float, end: float):
+        thread = threading.current_thread()
+        record = {
+            "name": span.name,
+            "start_s": round(start - self._t0, 6),
+            "dur_ms": round((end - start) * 1000, 3),
+            "thread": thread.name,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+        record.update(span.attrs)
+
+        with self._lock:
+            if self._jsonl:
+                self._jsonl.write(json.dumps(record, default=str) + "\n")
+            if self._chrome:
+                if thread.ident not in self._named_threads:
+                    self._named_threads.add(thread.ident)
+                    self._write_chrome({
+                        "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread.ident,
+                        "args": {"name": thread.name},
+                    })
+                self._write_chrome({
+                    "name": span.name, "ph": "X", "pid": os.getpid(), "tid": thread.ident,
+                    "ts": round((start - self._t0) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+                    "args": {k: v for k, v in record.items() if k not in ("name", "start_s", "dur_ms", "thread")},
+                })
+
+    def _write_chrome(self, event: dict):
+        self._chrome.write(("" if self._chrome_first else ",\n") + json.dumps(event, default=str))
+        self._chrome_first = False
+        self._chrome.flush()
+
+    def close(self):
+        with self._lock:
+            if self._jsonl:
+                self._jsonl.close()
+                self._jsonl = None
+            if self._chrome:
+                self._chrome.write("\n]\n")
+                self._chrome.close()
+                self._chrome = None
+            self.enabled = False
+
+
+# One tracer per process; main() configures it from --trace / --chrome-trace
+TRACER = Tracer()
+
+
+def summarize(jsonl_path: str, top: int = 10):
+    """
+    Totals per span name, the slowest model calls and generations that look broken.
+    """
+    with open(jsonl_path, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    totals = defaultdict(lambda: [0, 0.0])
+    for record in records:
+        totals[record["name"]][0] += 1
+        totals[record["name"]][1] += record["dur_ms"]
+
+    print(f"{'span':<16} {'count':>6} {'total s':>10} {'avg ms':>10}")
+    for name, (count, total_ms) in sorted(totals.items(), key=lambda kv: -kv[1][1]):
+        print(f"{name:<16} {count:>6} {total_ms / 1000:>10.2f} {total_ms / count:>10.1f}")
+
+    generations = [r for r in records if r["name"] in ("generate", "batched_generate")]
+    if generations:
+        print(f"\nSlowest {min(top, len(generations))} generations:")
+        for r in sorted(generations, key=lambda r: -r["dur_ms"])[:top]:
+            print(
+                f"  {r['dur_ms'] / 1000:7.2f}s  {r.get('adapter')}  {r.get('generated_tokens')} tok"
+                f"  {r.get('tokens_per_second')} tok/s  ttft {r.get('ttft_ms')} ms"
+            )
+
+    suspicious = [
+        r for r in generations
+        if r.get("repetition", 0) >= REPETITION_WARNING or r.get("hit_max_tokens")
+    ]
+    if suspicious:
+        print(f"\n⚠️ {len(suspicious)} suspicious generations (repetition >= {REPETITION_WARNING} or hit max_tokens):")
+        for r in suspicious[:top]:
+            print(f"  {r.get('adapter')}  repetition {r.get('repetition')}  {r.get('generated_tokens')} tok")
+
+    drafted = defaultdict(list)
+    for r in generations:
+        if r.get("acceptance_rate") is not None:
+            drafted[r.get("adapter") or "base"].append(r["acceptance_rate"])
+    if drafted:
+        print("\nSpeculative decoding acceptance rate:")
+        for adapter, rates in sorted(drafted.items()):
+            print(f"  {adapter:<12} {sum(rates) / len(rates):6.1%}  over {len(rates)} calls")
+
+    sections = [r for r in records if r["name"] == "section"]
+    if sections:
+        print(f"\nSlowest {min(top, len(sections))} sections:")
+        for r in sorted(sections, key=lambda r: -r["dur_ms"])[:top]:
+            print(f"  {r['dur_ms'] / 1000:7.2f}s  {r.get('style')}  {r.get('paper')} / {r.get('section')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a pipeline trace (JSON lines)")
+    parser.add_argument("trace", help="File written with --trace")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    summarize(args.trace, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,70 +1,186 @@
 import os
 import re
-from mlx_vlm import load, generate
-from mlx_vlm.prompt_utils import apply_chat_template
-from mlx_vlm.utils import load_config
+from utils.cache import DiskCache, hash_file
+from utils.image_triage import MAX_CAPTION_PIXELS, TRIAGE, downscale, triage_images
+from utils.tracing import TRACER
 
 # We use Qwen2-VL-2B (Quantized). It's tiny (~1.5GB) but SOTA for charts/OCR.
 VISION_MODEL = "mlx-community/Qwen2-VL-2B-Instruct-4bit"
 
-def caption_images_in_markdown(md_content, base_path):
+# Prompt for Research Papers
+CAPTION_PROMPT = "Describe this image in detail. If it's a chart, read the data. If it's a diagram, explain the flow."
+
+CAPTION_PARAMS = {
+    "max_tokens": 500,
+    "repeat_penalty": 1.1, # <--- 1.1 or 1.2 stops loops
+}
+
+IMAGE_LINK_PATTERN = re.compile(r'!\[.*?\]\((.*?)\)')
+
+def default_vision_backend():
+    from utils.backends import MLXVisionBackend
+    return MLXVisionBackend(VISION_MODEL)
+
+def caption_cache_key(image_hash: str, vision, max_pixels: int = None) -> str:
+    parts = dict(backend=vision.cache_id, prompt=CAPTION_PROMPT, image=image_hash, params=CAPTION_PARAMS)
+    # Only downscaled images depend on the pixel budget, so captions of the rest stay valid
+    if max_pixels:
+        parts["max_pixels"] = max_pixels
+    return DiskCache.make_key(**parts)
+
+def caption_image(vision, full_path: str, pixels: int = None) -> str:
+    # Generate Caption
+    with TRACER.span("caption", image=os.path.basename(full_path), image_kb=os.path.getsize(full_path) // 1024, pixels=pixels) as span:
+        caption_text = vision.caption(full_path, CAPTION_PROMPT, **CAPTION_PARAMS).strip().replace("\n", " ")
+        span.set(caption_chars=len(caption_text))
+    return caption_text
+
+def plan_captions(md_content, base_path, vision, cache=None, known=None):
     """
-    Finds all ![img](path) links, runs a VLM on them, and inserts the description.
+    CPU-only half of captioning: finds the image links, hashes the image bytes and
+    resolves everything that is already known (cache hits, duplicates).
+    Safe to run on a background thread while the VLM is busy with another paper.
+    known is an optional {caption_key: caption} (e.g. from the previous version of the paper).
+
+    Images are triaged first (utils.image_triage): decorative ones are skipped, near-duplicates
+    share one caption and oversized ones are marked for downscaling to MAX_CAPTION_PIXELS.
+    Nothing is written: the downscaled copy is made by run_captions right before the VLM call.
+
+    Returns None when there are no images, otherwise a dict with:
+      "links":    number of image links in the document
+      "captions": {rel_path: caption} for everything already known
+      "pending":  {caption_key: {"full_path": ..., "downscale": features or None, "rel_paths": [...]}} still to caption
+      "keys":     {rel_path: caption_key}
+      "skipped":  {rel_path: reason} for images that won't be captioned
     """
     # Find all image links: ![alt](path)
     # We use a regex that captures the path
-    image_links = re.findall(r'!\[.*?\]\((.*?)\)', md_content)
-    
+    image_links = IMAGE_LINK_PATTERN.findall(md_content)
+
     if not image_links:
-        return md_content
+        return None
+
+    # Same path linked twice -> one caption
+    unique_links = list(dict.fromkeys(image_links))
+
+    captions = {}          # rel_path -> caption text
+    captions_by_key = {}   # caption key (image bytes hash + backend + prompt) -> caption text
+    pending = {}           # caption key -> what still needs the VLM
+    keys = {}              # rel_path -> caption key
 
-    print(f"Found {len(image_links)} images. Waking up Vision Model...")
-    
-    # Load Model (Only stays in RAM for this function)
-    model, processor = load(VISION_MODEL)
-    config = load_config(VISION_MODEL)
-    
-    new_content = md_content
-
-    for rel_path in image_links:
-        # Construct full path (Obsidian uses relative paths, Python needs absolute)
-        # Warning: You might need to adjust this join depending on your folder structure
+    # Construct full paths (Obsidian uses relative paths, Python needs absolute)
+    # Warning: You might need to adjust this join depending on your folder structure
+    full_paths = {}
+    for rel_path in unique_links:
         full_path = os.path.join(base_path, rel_path)
-        
         if not os.path.exists(full_path):
             print(f"Image not found: {full_path}")
             continue
+        full_paths[rel_path] = full_path
+
+    triage = triage_images(full_paths) if TRIAGE else {"features": {}, "skipped": {}, "same_as": {}}
+
+    for rel_path, full_path in full_paths.items():
+        if rel_path in triage["skipped"]:
+            continue
+
+        features = triage["features"].get(rel_path)
+        oversized = features is not None and features["width"] * features["height"] > MAX_CAPTION_PIXELS
+        first = triage["same_as"].get(rel_path)
+        if first is not None and first in keys:
+            key = keys[first]
+        else:
+            key = caption_cache_key(hash_file(full_path), vision, MAX_CAPTION_PIXELS if oversized else None)
+        keys[rel_path] = key
+        if key in pending:
+            pending[key]["rel_paths"].append(rel_path)
+            continue
+
+        caption_text = captions_by_key.get(key)
+        if caption_text is None and known:
+            caption_text = known.get(key)
+        if caption_text is None and cache is not None:
+            caption_text = cache.get(key)
+
+        if caption_text is None:
+            pending[key] = {
+                "full_path": full_path,
+                "downscale": features if oversized else None,
+                "pixels": features["width"] * features["height"] if features else None,
+                "rel_paths": [rel_path],
+            }
+            continue
+
+        captions_by_key[key] = caption_text
+        captions[rel_path] = caption_text
+
+    return {
+        "links": len(image_links),
+        "captions": captions,
+        "pending": pending,
+        "keys": keys,
+        "skipped": triage["skipped"],
+    }
+
+def run_captions(plan, vision, cache=None):
+    """
+    VLM half of captioning: captions every pending image of a plan (once per distinct image).
+    """
+    for key, todo in plan["pending"].items():
+        print(f"Captioning: {todo['rel_paths'][0]}...", end="\r")
+        caption_path = downscale(todo["full_path"], todo["downscale"]) if todo.get("downscale") else None
+        try:
+            caption_text = caption_image(vision, caption_path or todo["full_path"], todo.get("pixels"))
+        finally:
+            if caption_path:
+                os.remove(caption_path)
+        if cache is not None:
+            cache.put(key, caption_text, meta={"image": todo["rel_paths"][0]})
+        for rel_path in todo["rel_paths"]:
+            plan["captions"][rel_path] = caption_text
+
+    skipped = plan.get("skipped", {})
+    print(f"   Captioned {plan['links']} images ({len(plan['pending'])} new, {len(skipped)} skipped).")
+    for rel_path, reason in skipped.items():
+        print(f"   ⏭️ {os.path.basename(rel_path)}: {reason}")
+    plan["pending"] = {}
+    return plan["captions"]
+
+def caption_images_in_markdown(md_content, base_path, vision=None, cache=None):
+    """
+    Finds all ![img](path) links, runs a VLM on them, and inserts the description.
+
+    Captions are keyed by the image BYTES (+ model and prompt), so a logo repeated on
+    every page or a figure referenced twice is captioned once. Pass a DiskCache to
+    keep them across runs, and a shared vision backend to reuse the VLM across papers.
+    """
+    # Model loads lazily (Only stays in RAM for this function unless the caller owns it)
+    owns_vision = vision is None
+    if owns_vision:
+        vision = default_vision_backend()
+
+    plan = plan_captions(md_content, base_path, vision, cache)
+    if plan is None:
+        return md_content
+
+    try:
+        return inject_captions(md_content, run_captions(plan, vision, cache))
+    finally:
+        if owns_vision:
+            vision.unload()
+
+def inject_captions(md_content, captions):
+    """
+    Rewrites the markdown in ONE linear pass, putting each caption right under its image link.
+    Every occurrence of a link gets exactly one caption block.
+    """
+    # We turn: ![img](path)
+    # Into:  ![img](path)
+    #        > **AI Vision:** *A diagram showing the Transformer architecture...*
+    def add_caption(match):
+        caption_text = captions.get(match.group(1))
+        if caption_text is None:
+            return match.group(0)
+        return f"{match.group(0)}\n> [!INFO] AI Vision\n> *{caption_text}*\n"
 
-        print(f"Captioning: {rel_path}...", end="\r")
-        
-        # Prompt for Research Papers
-        prompt = "Describe this image in detail. If it's a chart, read the data. If it's a diagram, explain the flow."
-        
-        formatted_prompt = apply_chat_template(
-            processor, config, prompt, num_images=1
-        )
-
-        # Generate Caption
-        output = generate(
-            model, 
-            processor, 
-            formatted_prompt, 
-            [full_path], 
-            max_tokens=500, 
-            verbose=False, 
-            repeat_penalty=1.1 # <--- 1.1 or 1.2 stops loops
-        )
-        
-        # Extract text from GenerationResult object
-        caption_text = output.text.strip().replace("\n", " ")
-        
-        # Inject Caption into Markdown
-        # We turn: ![img](path)
-        # Into:  ![img](path)
-        #        > **AI Vision:** *A diagram showing the Transformer architecture...*
-        caption_block = f"({rel_path})\n> [!INFO] AI Vision\n> *{caption_text}*\n"
-
-        new_content = new_content.replace(f"({rel_path})", caption_block)
-
-    print(f"   Captioned {len(image_links)} images.")
-    return new_content
\ No newline at end of file
+    return IMAGE_LINK_PATTERN.sub(add_caption, md_content)